@@ -1,4 +1,5 @@
 from PIL import Image
+import math
 import os
 import io
 import datetime
@@ -7,42 +8,149 @@ from PIL import ImageOps
 
 logger = logging.getLogger(__name__)
 
+OUTPUT_FORMATS = {"jpeg": ("JPEG", ".jpg"), "webp": ("WEBP", ".webp")}
+MIN_QUALITY = 30
+QUALITY_STEP = 5
+MIN_EDGE = 16
+# Downscale a little past the area estimate, since size is not quite linear in pixels.
+DOWNSCALE_MARGIN = 0.9
+# The scale search stops once a result fills this much of the target, or after
+# SCALE_SEARCH_STEPS halvings of the scale bracket.
+TARGET_FILL = 0.9
+SCALE_SEARCH_STEPS = 6
 
-def compress_image(input_path: str, output_dir: str, max_size: int = 500, quality: int = 85) -> str | None:
+
+def _encode(img: Image.Image, image_format: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if image_format == "WEBP":
+        img.save(buffer, "WEBP", quality=quality, method=4)
+    else:
+        img.save(buffer, "JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _search_quality(
+    img: Image.Image, image_format: str, levels: list[int], max_bytes: int
+) -> tuple[bytes | None, int, int]:
+    """Binary-search ``levels`` (ascending) for the highest quality under ``max_bytes``.
+
+    Returns ``(best_encoding or None, smallest size seen, encodes)``.
+    """
+    best = None
+    smallest = None
+    encodes = 0
+    low, high = 0, len(levels) - 1
+    while low <= high:
+        middle = (low + high) // 2
+        data = _encode(img, image_format, levels[middle])
+        encodes += 1
+        smallest = len(data) if smallest is None else min(smallest, len(data))
+        if len(data) <= max_bytes:
+            best = data
+            low = middle + 1
+        else:
+            high = middle - 1
+    return best, smallest, encodes
+
+
+def _search_scale(
+    img: Image.Image, image_format: str, levels: list[int], max_bytes: int, full_size: int
+) -> tuple[bytes, Image.Image, int]:
+    """Find close to the largest downscale of ``img`` that fits ``max_bytes``.
+
+    Encodes at the middle quality level: shrinking loses less detail than
+    pushing quality to the floor. ``full_size`` is the smallest full-scale
+    encoding seen, used to estimate the first scale. Returns
+    ``(encoding, scaled image, encodes)``.
+    """
+    scale_quality = levels[(len(levels) - 1) // 2]
+    encodes = 0
+
+    def encode_at(scale: float) -> tuple[bytes, Image.Image]:
+        nonlocal encodes
+        size = (max(MIN_EDGE, int(img.width * scale)), max(MIN_EDGE, int(img.height * scale)))
+        scaled = img.resize(size, Image.Resampling.LANCZOS)
+        encodes += 1
+        return _encode(scaled, image_format, scale_quality), scaled
+
+    # Shrink by the byte overshoot until something fits; that brackets the answer.
+    high, low = 1.0, math.sqrt(max_bytes / full_size) * DOWNSCALE_MARGIN
+    data, scaled = encode_at(low)
+    while len(data) > max_bytes:
+        if min(scaled.size) <= MIN_EDGE:
+            # Nothing left to shrink; keep the smallest encoding.
+            encodes += 1
+            return _encode(scaled, image_format, MIN_QUALITY), scaled, encodes
+        high, low = low, low * math.sqrt(max_bytes / len(data)) * DOWNSCALE_MARGIN
+        data, scaled = encode_at(low)
+
+    # Then binary-search the scale upward until the result is just under the target.
+    for _ in range(SCALE_SEARCH_STEPS):
+        if len(data) >= max_bytes * TARGET_FILL:
+            break
+        middle = (low + high) / 2
+        candidate, candidate_img = encode_at(middle)
+        if len(candidate) <= max_bytes:
+            low, data, scaled = middle, candidate, candidate_img
+        else:
+            high = middle
+    return data, scaled, encodes
+
+
+def compress_image(
+    input_path: str | bytes,
+    output_dir: str,
+    max_size: int = 500,
+    quality: int = 85,
+    output_format: str = "jpeg",
+) -> str | None:
+    """Compress to at most ``max_size`` KB as JPEG or WebP; ``input_path`` may also be the image bytes.
+
+    Quality is binary-searched between ``MIN_QUALITY`` and ``quality``; when
+    even the lowest quality is too large, the scale is binary-searched instead
+    (see ``_search_scale``), so a result just under the target is always found.
+    An original already under the target is returned only when it is in the
+    requested format.
+    """
+    image_format, extension = OUTPUT_FORMATS[output_format]
     os.makedirs(output_dir, exist_ok=True)
-    file_name = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_compressed.jpg"
+    file_name = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_compressed{extension}"
     output_path = os.path.join(output_dir, file_name)
     max_size_bytes = max_size * 1024
 
     try:
-        original_size_bytes = os.path.getsize(input_path)
-        if original_size_bytes <= max_size_bytes:
-            logger.info("Image already under %d KB, returning original.", max_size)
-            return input_path
+        in_memory = isinstance(input_path, bytes)
+        original_size_bytes = len(input_path) if in_memory else os.path.getsize(input_path)
 
-        with Image.open(input_path) as original_img:
-            img = ImageOps.exif_transpose(original_img)
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-
-            img_buffer = io.BytesIO()
-            current_quality = quality
+        with Image.open(io.BytesIO(input_path) if in_memory else input_path) as original_img:
+            if original_size_bytes <= max_size_bytes and original_img.format == image_format:
+                logger.info("Image already under %d KB, returning original.", max_size)
+                if not in_memory:
+                    return input_path
+                with open(output_path, "wb") as f:
+                    f.write(input_path)
+                return output_path
 
-            while current_quality > 10:
-                img_buffer.seek(0)
-                img_buffer.truncate(0)
-                img.save(img_buffer, "JPEG", optimize=True, quality=current_quality)
-
-                if img_buffer.tell() <= max_size_bytes:
-                    with open(output_path, "wb") as f:
-                        f.write(img_buffer.getvalue())
-                    logger.info("Compressed successfully: %s", output_path)
-                    return output_path
+            img = ImageOps.exif_transpose(original_img)
+            if image_format == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            elif image_format == "WEBP" and img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "A" in img.getbands() or img.mode == "P" else "RGB")
 
-                current_quality -= 5
+            levels = list(range(MIN_QUALITY, max(quality, MIN_QUALITY) + 1, QUALITY_STEP))
+            data, smallest, total_encodes = _search_quality(img, image_format, levels, max_size_bytes)
+            scaled = img
+            if data is None:
+                data, scaled, encodes = _search_scale(img, image_format, levels, max_size_bytes, smallest)
+                total_encodes += encodes
 
-            logger.warning("Could not compress to target size.")
-            return None
+        with open(output_path, "wb") as f:
+            f.write(data)
+        logger.info(
+            "Compressed %d KB -> %d KB (%dx%d, %d encodes): %s",
+            original_size_bytes // 1024, len(data) // 1024, scaled.width, scaled.height, total_encodes, output_path,
+        )
+        return output_path
 
     except Exception as e:
         logger.error("Image compression error: %s", e)
@@ -1,26 +1,37 @@
 from PIL import Image
 import img2pdf
 import fitz
+import io
 import os
 import datetime
 import logging
+from typing import Callable, Sequence
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_DPI = 300
+DEFAULT_JPEG_QUALITY = 90
 
-def convert_image_to_pdf(image_path: str, output_dir: str) -> str | None:
+
+def _describe(source: str | bytes) -> str:
+    return f"<{len(source)} bytes>" if isinstance(source, bytes) else source
+
+
+def convert_image_to_pdf(image_path: str | bytes, output_dir: str) -> str | None:
+    """Wrap the image in a PDF; ``image_path`` may also be the image bytes."""
     os.makedirs(output_dir, exist_ok=True)
     file_name = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
     pdf_path = os.path.join(output_dir, file_name)
 
     try:
-        with Image.open(image_path) as image:
-            pdf_bytes = img2pdf.convert(image.filename)
+        in_memory = isinstance(image_path, bytes)
+        with Image.open(io.BytesIO(image_path) if in_memory else image_path) as image:
+            pdf_bytes = img2pdf.convert(image_path if in_memory else image.filename)
 
         with open(pdf_path, "wb") as f:
             f.write(pdf_bytes)
 
-        logger.info("Converted %s to %s", image_path, pdf_path)
+        logger.info("Converted %s to %s", _describe(image_path), pdf_path)
         return pdf_path
 
     except FileNotFoundError:
@@ -31,19 +42,60 @@ def convert_image_to_pdf(image_path: str, output_dir: str) -> str | None:
         return None
 
 
-def convert_pdf_to_images(pdf_path: str, output_dir: str, dpi: int = 300) -> str | None:
+def _open_pdf(pdf_path: str | bytes) -> fitz.Document:
+    return fitz.open(stream=pdf_path, filetype="pdf") if isinstance(pdf_path, bytes) else fitz.open(pdf_path)
+
+
+def pdf_page_count(pdf_path: str | bytes) -> int:
+    with _open_pdf(pdf_path) as doc:
+        return len(doc)
+
+
+def render_pdf_pages(
+    pdf_path: str | bytes,
+    output_dir: str,
+    first_page: int,
+    last_page: int,
+    dpi: int = DEFAULT_DPI,
+    quality: int = DEFAULT_JPEG_QUALITY,
+    progress: Callable[[int, int], None] | None = None,
+) -> list[str]:
+    """Render pages ``first_page``..``last_page`` (1-based, inclusive) to JPEGs in ``output_dir``.
+
+    Each call opens its own document, so ranges of one PDF can be rendered in
+    separate processes. Returns the image paths in page order; raises on failure.
+    """
+    paths = []
+    with _open_pdf(pdf_path) as doc:
+        last_page = min(last_page, len(doc))
+        total = last_page - first_page + 1
+        for number in range(first_page, last_page + 1):
+            pix = doc.load_page(number - 1).get_pixmap(dpi=dpi)
+            image_path = os.path.join(output_dir, f"page_{number:04d}.jpg")
+            pix.save(image_path, jpg_quality=quality)
+            del pix  # one full-size pixmap alive at a time
+            paths.append(image_path)
+            if progress:
+                progress(len(paths), total)
+    return paths
+
+
+def convert_pdf_to_images(
+    pdf_path: str | bytes,
+    output_dir: str,
+    dpi: int = DEFAULT_DPI,
+    progress: Callable[[int, int], None] | None = None,
+    pages: Sequence[int] | None = None,
+    quality: int = DEFAULT_JPEG_QUALITY,
+) -> str | None:
+    """Render ``pages`` (``[first, last]``, default all) in this process."""
     output_subdir = os.path.join(output_dir, f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_images")
     os.makedirs(output_subdir, exist_ok=True)
 
     try:
-        with fitz.open(pdf_path) as doc:
-            page_count = len(doc)
-            for i, page in enumerate(doc):
-                pix = page.get_pixmap(dpi=dpi)
-                image_path = os.path.join(output_subdir, f"page_{i+1}.jpg")
-                pix.save(image_path)
-
-        logger.info("Converted %s to %d images in %s", pdf_path, page_count, output_subdir)
+        first_page, last_page = pages or (1, pdf_page_count(pdf_path))
+        paths = render_pdf_pages(pdf_path, output_subdir, first_page, last_page, dpi, quality, progress)
+        logger.info("Converted %s to %d images in %s", _describe(pdf_path), len(paths), output_subdir)
         return output_subdir
 
     except FileNotFoundError:
@@ -2,19 +2,28 @@ import os
 import io
 import shutil
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Callable
 from PIL import Image
 import fitz
 from pypdf import PdfReader, PdfWriter
 
 logger = logging.getLogger(__name__)
 
+TARGET_IMAGE_DPI = 150
+# Images shown at up to this factor above the target are left at full size.
+DOWNSAMPLE_TOLERANCE = 1.2
+MIN_IMAGE_BYTES = 4 * 1024
+# A re-encoded image must be at least this much smaller to replace the original.
+MIN_IMAGE_SAVING = 0.1
 
-def _compress_pdf_streams(input_path: str, output_dir: str) -> str | None:
+
+def _compress_pdf_streams(input_path: str | bytes, output_dir: str) -> str | None:
     output_path = os.path.join(output_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_streams_compressed.pdf")
 
     try:
-        reader = PdfReader(input_path)
+        reader = PdfReader(io.BytesIO(input_path) if isinstance(input_path, bytes) else input_path)
         writer = PdfWriter()
 
         for page in reader.pages:
@@ -29,45 +38,127 @@ def _compress_pdf_streams(input_path: str, output_dir: str) -> str | None:
         return None
 
 
-def _compress_pdf_images(input_path: str, output_dir: str, quality: int = 75) -> str | None:
+def _open_pdf(input_path: str | bytes) -> fitz.Document:
+    return fitz.open(stream=input_path, filetype="pdf") if isinstance(input_path, bytes) else fitz.open(input_path)
+
+
+def _scan_images(doc: fitz.Document) -> dict[int, tuple[int, float]]:
+    """Map each unique image xref to ``(first page, lowest effective DPI it is shown at)``.
+
+    The largest placement needs the most pixels, so it decides how far an
+    image can be downsampled.
+    """
+    images: dict[int, tuple[int, float]] = {}
+    for page_num in range(len(doc)):
+        page = doc.load_page(page_num)
+        for img in page.get_images(full=True):
+            xref, smask, width, height = img[0], img[1], img[2], img[3]
+            if smask:
+                continue  # re-encoding as JPEG would drop the transparency mask
+            # Unlike get_image_rects, this does not decode the image.
+            rect = page.get_image_bbox(img)
+            dpi = float("inf")
+            if rect.width > 0 and rect.height > 0:
+                dpi = min(width * 72 / rect.width, height * 72 / rect.height)
+            first_page, known_dpi = images.get(xref, (page_num, float("inf")))
+            images[xref] = (first_page, min(known_dpi, dpi))
+    return images
+
+
+def _recompress_image(image_bytes: bytes, dpi: float, quality: int, target_dpi: int) -> bytes | None:
+    """Downsample to ``target_dpi`` and re-encode as JPEG; None when that is not smaller."""
+    if len(image_bytes) < MIN_IMAGE_BYTES:
+        return None
+    with Image.open(io.BytesIO(image_bytes)) as pil_image:
+        size = None
+        if dpi != float("inf") and dpi > target_dpi * DOWNSAMPLE_TOLERANCE:
+            scale = target_dpi / dpi
+            size = (max(1, round(pil_image.width * scale)), max(1, round(pil_image.height * scale)))
+            # JPEG sources decode straight at a reduced scale (no smaller than size).
+            pil_image.draft(pil_image.mode, size)
+        img = pil_image
+        if img.mode == "1":
+            img = img.convert("L")
+        elif img.mode not in ("L", "RGB", "CMYK"):
+            img = img.convert("RGB")
+        if size is not None and img.size != size:
+            img = img.resize(size, Image.Resampling.LANCZOS)
+        img_buffer = io.BytesIO()
+        img.save(img_buffer, format="JPEG", quality=quality, optimize=True)
+    if img_buffer.tell() >= len(image_bytes) * (1 - MIN_IMAGE_SAVING):
+        return None
+    return img_buffer.getvalue()
+
+
+def _compress_pdf_images(
+    input_path: str | bytes,
+    output_dir: str,
+    quality: int = 75,
+    progress: Callable[[int, int, str], None] | None = None,
+    target_dpi: int = TARGET_IMAGE_DPI,
+    workers: int = 1,
+) -> str | None:
+    """Re-encode each unique image once, downsampled to ``target_dpi`` where it is shown.
+
+    Images are extracted and replaced on this thread (the document is not
+    thread-safe); decoding, resizing and encoding run on ``workers`` threads,
+    which Pillow lets run in parallel.
+    """
     output_path = os.path.join(output_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_image_compressed.pdf")
 
     try:
-        doc = fitz.open(input_path)
-        image_found = False
-
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-
-            for img_index, img in enumerate(page.get_images(full=True)):
-                xref = img[0]
-                base_image = doc.extract_image(xref)
-                image_bytes = base_image["image"]
-
-                pil_image = Image.open(io.BytesIO(image_bytes))
-                img_buffer = io.BytesIO()
-                pil_image.save(img_buffer, format="JPEG", quality=quality, optimize=True)
-                img_buffer.seek(0)
-
-                page.replace_image(xref, stream=img_buffer.getvalue())
-                image_found = True
-
-        if not image_found:
-            logger.warning("No images found to compress in PDF.")
-            doc.close()
-            return None
-
-        doc.save(output_path, garbage=4, deflate=True, clean=True)
-        doc.close()
+        with _open_pdf(input_path) as doc:
+            images = _scan_images(doc)
+            if not images:
+                logger.warning("No images found to compress in PDF.")
+                return None
+
+            def recompress(xref: int, image_bytes: bytes) -> bytes | None:
+                try:
+                    return _recompress_image(image_bytes, images[xref][1], quality, target_dpi)
+                except Exception as e:
+                    logger.warning("Keeping image %d as is: %s", xref, e)
+                    return None
+
+            xrefs = list(images)
+            # Extract in small windows so a large scan's images are not all in memory at once.
+            window = max(1, workers) * 2
+            replaced = 0
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                for start in range(0, len(xrefs), window):
+                    batch = xrefs[start : start + window]
+                    originals = [doc.extract_image(xref)["image"] for xref in batch]
+                    for xref, new_bytes in zip(batch, executor.map(recompress, batch, originals)):
+                        if new_bytes is not None:
+                            doc.load_page(images[xref][0]).replace_image(xref, stream=new_bytes)
+                            replaced += 1
+                    if progress:
+                        progress(start + len(batch), len(xrefs), "image")
+
+            logger.info("Re-encoded %d of %d unique images", replaced, len(images))
+            if not replaced:
+                return None
+            doc.save(output_path, garbage=4, deflate=True, clean=True)
         return output_path
     except Exception as e:
         logger.error("Image compression error: %s", e)
         return None
 
 
-def compress_pdf(input_path: str, output_dir: str, reduction_threshold: float = 0.75) -> str:
+def compress_pdf(
+    input_path: str | bytes,
+    output_dir: str,
+    reduction_threshold: float = 0.75,
+    progress: Callable[[int, int, str], None] | None = None,
+    image_workers: int = 1,
+) -> str:
+    """Compress a PDF given by path or as bytes; falls back to a copy of the original.
+
+    ``image_workers`` threads re-encode the PDF's images in parallel.
+    """
     os.makedirs(output_dir, exist_ok=True)
-    original_size = os.path.getsize(input_path)
+    in_memory = isinstance(input_path, bytes)
+    original_size = len(input_path) if in_memory else os.path.getsize(input_path)
 
     logger.info("Attempting stream compression...")
     stream_compressed_path = _compress_pdf_streams(input_path, output_dir)
@@ -82,7 +173,7 @@ def compress_pdf(input_path: str, output_dir: str, reduction_threshold: float =
             os.remove(stream_compressed_path)
 
     logger.info("Attempting image re-compression...")
-    image_compressed_path = _compress_pdf_images(input_path, output_dir)
+    image_compressed_path = _compress_pdf_images(input_path, output_dir, progress=progress, workers=image_workers)
 
     if image_compressed_path:
         image_compressed_size = os.path.getsize(image_compressed_path)
@@ -94,6 +185,11 @@ def compress_pdf(input_path: str, output_dir: str, reduction_threshold: float =
             os.remove(image_compressed_path)
 
     logger.warning("No compression effective, copying original.")
+    if in_memory:
+        final_path = os.path.join(output_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_original.pdf")
+        with open(final_path, "wb") as f:
+            f.write(input_path)
+        return final_path
     final_path = os.path.join(output_dir, os.path.basename(input_path))
     shutil.copy2(input_path, final_path)
     return final_path
@@ -1,3 +1,21 @@
-from .openrouter_client import generate_response
+from .openrouter_client import (
+    close_http_client,
+    generate_response,
+    generate_response_async,
+    get_cache_stats,
+    get_latency_stats,
+    open_http_client,
+    stream_response_async,
+)
+from .resilience import CircuitOpenError
 
-__all__ = ["generate_response"]
+__all__ = [
+    "CircuitOpenError",
+    "close_http_client",
+    "generate_response",
+    "generate_response_async",
+    "get_cache_stats",
+    "get_latency_stats",
+    "open_http_client",
+    "stream_response_async",
+]
@@ -0,0 +1,132 @@
+import io
+import logging
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Images already this small and within the edge cap are sent untouched.
+PASSTHROUGH_MAX_BYTES = 256 * 1024
+
+
+class ImageProfile(NamedTuple):
+    max_edge: int
+    quality: int
+
+
+DEFAULT_IMAGE_PROFILE = ImageProfile(max_edge=1568, quality=82)
+MODEL_IMAGE_PROFILES = {
+    "openai/gpt-4.1-mini": ImageProfile(max_edge=2048, quality=85),
+    "openai/gpt-4.1": ImageProfile(max_edge=2048, quality=85),
+    "openai/gpt-4o-mini": ImageProfile(max_edge=2048, quality=85),
+    "anthropic/claude-3.5-sonnet": ImageProfile(max_edge=1568, quality=85),
+    "google/gemini-flash-1.5": ImageProfile(max_edge=3072, quality=85),
+}
+
+_cache: OrderedDict[tuple[str, ImageProfile], tuple[bytes, str]] = OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+
+def get_image_profile(model_name: str) -> ImageProfile:
+    return MODEL_IMAGE_PROFILES.get(model_name, DEFAULT_IMAGE_PROFILE)
+
+
+def _cache_get(key: tuple[str, ImageProfile]) -> Optional[tuple[bytes, str]]:
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+        return entry
+
+
+def _cache_put(key: tuple[str, ImageProfile], entry: tuple[bytes, str]) -> None:
+    global _cache_bytes
+    with _cache_lock:
+        previous = _cache.pop(key, None)
+        if previous is not None:
+            _cache_bytes -= len(previous[0])
+        _cache[key] = entry
+        _cache_bytes += len(entry[0])
+        while _cache_bytes > CACHE_MAX_BYTES and len(_cache) > 1:
+            _, (evicted, _) = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted)
+
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """Return ``img`` as RGB or L, compositing any transparency onto white.
+
+    Transparent pixels are usually stored as black, so dropping the alpha
+    channel would turn dark-on-transparent text into an all-black image.
+    """
+    if "transparency" in img.info:
+        img = img.convert("RGBA")
+    if img.mode in ("RGBA", "LA", "PA"):
+        rgba = img.convert("RGBA")
+        flat = Image.new("RGB", rgba.size, (255, 255, 255))
+        flat.paste(rgba, mask=rgba.getchannel("A"))
+        return flat
+    if img.mode not in ("RGB", "L"):
+        return img.convert("RGB")
+    return img
+
+
+def _encode(file_path: str, mime_type: str, profile: ImageProfile, data: Optional[bytes] = None) -> tuple[bytes, str]:
+    if data is not None:
+        original = data
+    else:
+        with open(file_path, "rb") as f:
+            original = f.read()
+
+    try:
+        with Image.open(io.BytesIO(original)) as source:
+            if len(original) <= PASSTHROUGH_MAX_BYTES and max(source.size) <= profile.max_edge:
+                return original, mime_type
+
+            img = ImageOps.exif_transpose(source)
+            if max(img.size) > profile.max_edge:
+                img.thumbnail((profile.max_edge, profile.max_edge), Image.Resampling.LANCZOS)
+            img = _flatten(img)
+
+            buffer = io.BytesIO()
+            img.save(buffer, "JPEG", quality=profile.quality, optimize=True)
+    except Exception as exc:
+        logger.warning("Image preparation failed for %s, sending original: %s", file_path, exc)
+        return original, mime_type
+
+    prepared = buffer.getvalue()
+    if len(prepared) >= len(original):
+        return original, mime_type
+    logger.info("Prepared image for upload: %d KB -> %d KB", len(original) // 1024, len(prepared) // 1024)
+    return prepared, "image/jpeg"
+
+
+def prepare_image(
+    file_path: str,
+    mime_type: str,
+    model_name: str,
+    cache_key: Optional[str] = None,
+    data: Optional[bytes] = None,
+) -> tuple[bytes, str]:
+    """Return upload-ready image bytes and their mime type for ``model_name``.
+
+    The long edge is capped and the image re-encoded as JPEG according to the
+    model's profile. Results are cached by ``cache_key`` (Telegram's
+    ``file_unique_id``) when one is given. ``data``, when given, is the image
+    itself and ``file_path`` is not read.
+    """
+    profile = get_image_profile(model_name)
+    key = (cache_key, profile) if cache_key else None
+    if key is not None:
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached
+
+    prepared = _encode(file_path, mime_type, profile, data)
+    if key is not None:
+        _cache_put(key, prepared)
+    return prepared
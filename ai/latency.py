@@ -0,0 +1,51 @@
+import threading
+from collections import deque
+from typing import Any, Optional
+
+WINDOW_SIZE = 200
+MIN_SAMPLES = 20
+
+
+def _nearest_rank(sorted_samples: list[float], pct: float) -> float:
+    rank = round(pct / 100 * len(sorted_samples)) - 1
+    return sorted_samples[max(0, min(len(sorted_samples) - 1, rank))]
+
+
+class LatencyTracker:
+    """Rolling per-model latency samples (seconds) over the last ``window`` calls."""
+
+    def __init__(self, window: int = WINDOW_SIZE, min_samples: int = MIN_SAMPLES):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: dict[str, deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(model_name)
+            if samples is None:
+                samples = self._samples[model_name] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, model_name: str, pct: float) -> Optional[float]:
+        """Nearest-rank percentile, or None until ``min_samples`` calls are seen."""
+        with self._lock:
+            samples = sorted(self._samples.get(model_name, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return _nearest_rank(samples, pct)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            snapshot = {model: sorted(samples) for model, samples in self._samples.items()}
+        return {
+            model: {
+                "count": len(samples),
+                "p50": _nearest_rank(samples, 50),
+                "p95": _nearest_rank(samples, 95),
+                "p99": _nearest_rank(samples, 99),
+            }
+            for model, samples in snapshot.items()
+            if samples
+        }
+
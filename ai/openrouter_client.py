@@ -1,17 +1,89 @@
+import asyncio
 import base64
+import json
 import logging
 import mimetypes
 import time
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
 
+import httpx
 import requests
-from pypdf import PdfReader
+
+from singleflight import SingleFlight
+
+from .image_prep import prepare_image
+from .latency import LatencyTracker
+from .pdf_text import extract_pdf_text
+from .resilience import CircuitBreaker, RetryPolicy, UpstreamResponseError
+from .response_cache import make_cache_key, response_cache
+from .scheduler import ai_scheduler
+from .tokens import estimate_message_tokens, history_token_budget
 
 logger = logging.getLogger(__name__)
 
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 MAX_RETRIES = 3
 BASE_DELAY_SECONDS = 1.0
+MAX_DELAY_SECONDS = 20.0
+RETRY_DEADLINE_SECONDS = 120.0
+HEDGE_PERCENTILE = 95
+HEDGE_DEFAULT_DELAY_SECONDS = 10.0
+HEDGE_MIN_DELAY_SECONDS = 2.0
+HEDGE_MAX_DELAY_SECONDS = 30.0
+REQUEST_TIMEOUT_SECONDS = 90
+CONNECT_TIMEOUT_SECONDS = 10
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_KEEPALIVE_EXPIRY_SECONDS = 60
+
+_async_client: Optional[httpx.AsyncClient] = None
+
+retry_policy = RetryPolicy(
+    max_attempts=MAX_RETRIES,
+    base_delay=BASE_DELAY_SECONDS,
+    max_delay=MAX_DELAY_SECONDS,
+    deadline=RETRY_DEADLINE_SECONDS,
+)
+_circuit_breakers: dict[str, CircuitBreaker] = {}
+completion_latency = LatencyTracker()
+first_token_latency = LatencyTracker()
+_inflight_completions = SingleFlight()
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        http2 = _http2_available()
+        _async_client = httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(REQUEST_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+        )
+        logger.info("Opened pooled OpenRouter client (http2=%s)", http2)
+    return _async_client
+
+
+async def open_http_client() -> None:
+    _get_async_client()
+
+
+async def close_http_client() -> None:
+    global _async_client
+    if _async_client is not None and not _async_client.is_closed:
+        await _async_client.aclose()
+    _async_client = None
 
 
 def _normalize_history_text(parts: Any) -> str:
@@ -26,11 +98,15 @@ def _normalize_history_text(parts: Any) -> str:
     return "\n".join(chunk for chunk in normalized if chunk).strip()
 
 
-def _conversation_to_messages(history: Optional[list[dict[str, Any]]]) -> list[dict[str, Any]]:
+def _conversation_to_messages(
+    history: Optional[list[dict[str, Any]]],
+    max_tokens: Optional[int] = None,
+) -> list[dict[str, Any]]:
     if not history:
         return []
 
-    messages: list[dict[str, Any]] = []
+    pinned: list[dict[str, Any]] = []
+    turns: list[dict[str, Any]] = []
     for entry in history:
         if not isinstance(entry, dict):
             continue
@@ -41,42 +117,52 @@ def _conversation_to_messages(history: Optional[list[dict[str, Any]]]) -> list[d
             role = "user"
         text = _normalize_history_text(entry.get("parts", []))
         if text:
-            messages.append({"role": role, "content": text})
-    return messages
+            # System entries carry the rolling summary and are always kept.
+            (pinned if role == "system" else turns).append({"role": role, "content": text})
 
+    if max_tokens is None:
+        return pinned + turns
 
-def _extract_pdf_text(file_path: str, max_pages: int = 3, max_chars: int = 6000) -> str:
-    reader = PdfReader(file_path)
-    chunks: list[str] = []
-    for page in reader.pages[:max_pages]:
-        page_text = page.extract_text() or ""
-        if page_text.strip():
-            chunks.append(page_text.strip())
-        if sum(len(chunk) for chunk in chunks) >= max_chars:
+    budget = max_tokens - sum(estimate_message_tokens(m["content"]) for m in pinned)
+    kept: list[dict[str, Any]] = []
+    for message in reversed(turns):
+        cost = estimate_message_tokens(message["content"])
+        if cost > budget:
             break
-    text = "\n\n".join(chunks).strip()
-    return text[:max_chars]
+        budget -= cost
+        kept.append(message)
+    kept.reverse()
+    return pinned + kept
 
 
-def _file_content_parts(file_path: str) -> list[dict[str, Any]]:
+def _file_content_parts(
+    file_path: str,
+    model_name: str,
+    file_key: Optional[str] = None,
+    file_data: Optional[bytes] = None,
+) -> list[dict[str, Any]]:
+    # With ``file_data`` the file is already in memory; ``file_path`` only names it.
     mime_type, _ = mimetypes.guess_type(file_path)
     mime_type = mime_type or "application/octet-stream"
 
     if mime_type.startswith("image/"):
-        with open(file_path, "rb") as f:
-            encoded = base64.b64encode(f.read()).decode("ascii")
+        image_bytes, mime_type = prepare_image(file_path, mime_type, model_name, cache_key=file_key, data=file_data)
+        encoded = base64.b64encode(image_bytes).decode("ascii")
         data_url = f"data:{mime_type};base64,{encoded}"
         return [{"type": "image_url", "image_url": {"url": data_url}}]
 
     if mime_type == "application/pdf":
-        extracted = _extract_pdf_text(file_path)
+        extracted = extract_pdf_text(file_path, cache_key=file_key, data=file_data)
         if not extracted:
             return [{"type": "text", "text": "No readable text was extracted from the PDF."}]
         return [{"type": "text", "text": f"Extracted PDF content:\n{extracted}"}]
 
     if mime_type.startswith("text/"):
-        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
-            content = f.read(6000)
+        if file_data is not None:
+            content = file_data.decode("utf-8", errors="replace")[:6000]
+        else:
+            with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                content = f.read(6000)
         return [{"type": "text", "text": f"Attached file content:\n{content}"}]
 
     return [{"type": "text", "text": f"Attached file type `{mime_type}` cannot be directly parsed."}]
@@ -85,7 +171,7 @@ def _file_content_parts(file_path: str) -> list[dict[str, Any]]:
 def _extract_response_text(data: dict[str, Any]) -> str:
     choices = data.get("choices")
     if not isinstance(choices, list) or not choices:
-        raise ValueError("OpenRouter response missing choices")
+        raise UpstreamResponseError("OpenRouter response missing choices")
 
     message = choices[0].get("message", {})
     content = message.get("content")
@@ -99,34 +185,79 @@ def _extract_response_text(data: dict[str, Any]) -> str:
                 parts.append(item["text"])
         return "\n".join(parts).strip()
 
-    raise ValueError("OpenRouter response content is empty")
+    raise UpstreamResponseError("OpenRouter response content is empty")
 
 
-def generate_response(
-    api_key: str,
+def _extract_stream_delta(chunk: dict[str, Any]) -> str:
+    error = chunk.get("error")
+    if error:
+        message = error.get("message") if isinstance(error, dict) else error
+        raise UpstreamResponseError(f"OpenRouter stream error: {message}")
+
+    choices = chunk.get("choices")
+    if not isinstance(choices, list) or not choices:
+        return ""
+    delta = choices[0].get("delta") or {}
+    content = delta.get("content")
+    return content if isinstance(content, str) else ""
+
+
+def _build_messages(
     model_name: str,
     prompt: str,
-    system_instruction: Optional[str] = None,
-    file_path: Optional[str] = None,
-    conversation_history: Optional[list[dict[str, Any]]] = None,
-    referer: str = "",
-    app_name: str = "Telegram Agent",
-    max_retries: int = MAX_RETRIES,
-) -> str:
-    if not api_key:
-        raise ValueError("OPENROUTER_API_KEY is not configured")
-
+    system_instruction: Optional[str],
+    file_parts: Optional[list[dict[str, Any]]],
+    conversation_history: Optional[list[dict[str, Any]]],
+) -> list[dict[str, Any]]:
     messages: list[dict[str, Any]] = []
     if system_instruction:
         messages.append({"role": "system", "content": system_instruction})
-    messages.extend(_conversation_to_messages(conversation_history))
+    messages.extend(_conversation_to_messages(conversation_history, history_token_budget(model_name)))
 
     user_content: list[dict[str, Any]] = [{"type": "text", "text": prompt}]
-    if file_path:
-        user_content.extend(_file_content_parts(file_path))
+    if file_parts:
+        user_content.extend(file_parts)
 
     messages.append({"role": "user", "content": user_content})
+    return messages
+
+
+def _should_cache(
+    use_cache: Optional[bool],
+    file_path: Optional[str],
+    conversation_history: Optional[list[dict[str, Any]]],
+) -> bool:
+    if use_cache is not None:
+        return use_cache
+    # By default only context-free prompts are cached: they are the ones that recur verbatim.
+    return not file_path and not conversation_history
+
+
+async def _cache_get(key: str) -> Optional[str]:
+    if response_cache.persistent:
+        return await asyncio.to_thread(response_cache.get, key)
+    return response_cache.get(key)
+
+
+async def _cache_set(key: str, text: str) -> None:
+    if response_cache.persistent:
+        await asyncio.to_thread(response_cache.set, key, text)
+        return
+    response_cache.set(key, text)
 
+
+def get_cache_stats() -> dict[str, Any]:
+    return response_cache.stats()
+
+
+def get_latency_stats() -> dict[str, dict[str, Any]]:
+    return {
+        "completion": completion_latency.stats(),
+        "first_token": first_token_latency.stats(),
+    }
+
+
+def _build_headers(api_key: str, referer: str, app_name: str) -> dict[str, str]:
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
@@ -135,36 +266,446 @@ def generate_response(
         headers["HTTP-Referer"] = referer
     if app_name:
         headers["X-Title"] = app_name
+    return headers
+
+
+def _circuit_breaker(model_name: str) -> CircuitBreaker:
+    breaker = _circuit_breakers.get(model_name)
+    if breaker is None:
+        breaker = _circuit_breakers.setdefault(model_name, CircuitBreaker())
+    return breaker
+
+
+def _model_chain(model_name: str, fallback_models: Optional[list[str]]) -> list[str]:
+    chain = [model_name]
+    for fallback in fallback_models or []:
+        if fallback and fallback not in chain:
+            chain.append(fallback)
+    return chain
+
+
+def _hedge_delay(model_name: str) -> float:
+    observed = completion_latency.percentile(model_name, HEDGE_PERCENTILE)
+    if observed is None:
+        return HEDGE_DEFAULT_DELAY_SECONDS
+    return min(max(observed, HEDGE_MIN_DELAY_SECONDS), HEDGE_MAX_DELAY_SECONDS)
+
+
+async def _run_with_fallbacks(
+    models: list[str],
+    call: Callable[[str], Awaitable[str]],
+    hedge: bool,
+) -> str:
+    """Try ``models`` in order until one succeeds.
+
+    With ``hedge`` set, the next model is also started when the newest
+    in-flight call has not finished within that model's hedge delay; the
+    first successful result wins and the other calls are cancelled. The
+    caller holds one ``ai_scheduler`` slot; each hedged call takes another,
+    and hedging stops when none is free.
+    """
+    queue = list(models)
+    pending: dict[asyncio.Task, str] = {}
+    last_error: Optional[BaseException] = None
+    newest = ""
+
+    def launch(extra_slot: bool = False) -> None:
+        nonlocal newest
+        newest = queue.pop(0)
+        task = asyncio.create_task(call(newest))
+        if extra_slot:
+            task.add_done_callback(lambda _: ai_scheduler.release_extra())
+        pending[task] = newest
+
+    launch()
+    try:
+        while pending:
+            timeout = _hedge_delay(newest) if hedge and queue else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if not ai_scheduler.try_acquire_extra():
+                    logger.info("Model %s slower than %.1fs, but no spare AI slot to hedge", newest, timeout)
+                    hedge = False
+                    continue
+                logger.info("Model %s slower than %.1fs, hedging with %s", newest, timeout, queue[0])
+                launch(extra_slot=True)
+                continue
+            for task in done:
+                model = pending.pop(task)
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+                logger.warning("Model %s failed: %s", model, last_error)
+            if not pending and queue:
+                logger.info("Falling back to model %s", queue[0])
+                launch()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    raise last_error
+
 
+def _attempt_timeout(remaining: float) -> httpx.Timeout:
+    # Never let one attempt outlive the retry deadline.
+    read_timeout = min(REQUEST_TIMEOUT_SECONDS, max(remaining, CONNECT_TIMEOUT_SECONDS))
+    return httpx.Timeout(read_timeout, connect=CONNECT_TIMEOUT_SECONDS)
+
+
+def _log_attempt_failure(attempt: int, max_attempts: int, exc: Exception, delay: Optional[float]) -> None:
+    if delay is None:
+        logger.warning("OpenRouter attempt %d/%d failed, giving up: %s", attempt, max_attempts, exc)
+        return
+    logger.warning("OpenRouter attempt %d/%d failed, retrying in %.1fs: %s", attempt, max_attempts, delay, exc)
+
+
+def _generate_single(
+    api_key: str,
+    model_name: str,
+    prompt: str,
+    system_instruction: Optional[str],
+    file_path: Optional[str],
+    conversation_history: Optional[list[dict[str, Any]]],
+    referer: str,
+    app_name: str,
+    max_retries: int,
+    use_cache: Optional[bool],
+    file_key: Optional[str],
+    file_data: Optional[bytes] = None,
+) -> str:
+    file_parts = _file_content_parts(file_path, model_name, file_key, file_data) if file_path else None
     payload = {
         "model": model_name,
-        "messages": messages,
+        "messages": _build_messages(model_name, prompt, system_instruction, file_parts, conversation_history),
     }
+    cache_key = None
+    if _should_cache(use_cache, file_path, conversation_history):
+        cache_key = make_cache_key(model_name, payload["messages"], system_instruction)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    headers = _build_headers(api_key, referer, app_name)
+    breaker = _circuit_breaker(model_name)
 
-    last_error: Optional[Exception] = None
-    for attempt in range(max_retries):
+    retry = retry_policy.start(max_retries)
+    while True:
+        breaker.before_call()
+        started = time.monotonic()
         try:
             response = requests.post(
                 OPENROUTER_URL,
                 headers=headers,
                 json=payload,
-                timeout=90,
+                timeout=min(REQUEST_TIMEOUT_SECONDS, max(retry.remaining(), CONNECT_TIMEOUT_SECONDS)),
             )
             response.raise_for_status()
             body = response.json()
             text = _extract_response_text(body)
             if not text:
-                raise ValueError("OpenRouter returned empty text")
+                raise UpstreamResponseError("OpenRouter returned empty text")
+            breaker.record_success()
+            completion_latency.record(model_name, time.monotonic() - started)
+            if cache_key:
+                response_cache.set(cache_key, text)
             return text
         except (requests.RequestException, ValueError) as exc:
-            last_error = exc
-            logger.warning(
-                "OpenRouter attempt %d/%d failed: %s",
-                attempt + 1,
+            breaker.record_failure(exc)
+            delay = retry.next_delay(exc)
+            _log_attempt_failure(retry.attempt, retry.max_attempts, exc, delay)
+            if delay is None:
+                raise RuntimeError(f"OpenRouter request failed after {retry.attempt} attempts: {exc}") from exc
+            time.sleep(delay)
+
+
+def generate_response(
+    api_key: str,
+    model_name: str,
+    prompt: str,
+    system_instruction: Optional[str] = None,
+    file_path: Optional[str] = None,
+    conversation_history: Optional[list[dict[str, Any]]] = None,
+    referer: str = "",
+    app_name: str = "Telegram Agent",
+    max_retries: int = MAX_RETRIES,
+    use_cache: Optional[bool] = None,
+    file_key: Optional[str] = None,
+    fallback_models: Optional[list[str]] = None,
+    file_data: Optional[bytes] = None,
+) -> str:
+    if not api_key:
+        raise ValueError("OPENROUTER_API_KEY is not configured")
+
+    chain = _model_chain(model_name, fallback_models)
+    for index, model in enumerate(chain):
+        try:
+            return _generate_single(
+                api_key,
+                model,
+                prompt,
+                system_instruction,
+                file_path,
+                conversation_history,
+                referer,
+                app_name,
                 max_retries,
-                exc,
+                use_cache,
+                file_key,
+                file_data,
             )
-            if attempt < max_retries - 1:
-                time.sleep(BASE_DELAY_SECONDS * (2**attempt))
+        except RuntimeError as exc:
+            if index == len(chain) - 1:
+                raise
+            logger.warning("Model %s failed, falling back to %s: %s", model, chain[index + 1], exc)
+    raise RuntimeError("No model configured")
+
+
+async def _post_completion(
+    model_name: str,
+    payload: dict[str, Any],
+    headers: dict[str, str],
+    max_retries: int,
+    cache_key: Optional[str],
+) -> str:
+    client = _get_async_client()
+    breaker = _circuit_breaker(model_name)
 
-    raise RuntimeError(f"OpenRouter request failed after {max_retries} attempts: {last_error}")
+    retry = retry_policy.start(max_retries)
+    while True:
+        breaker.before_call()
+        started = time.monotonic()
+        try:
+            response = await client.post(
+                OPENROUTER_URL,
+                headers=headers,
+                json=payload,
+                timeout=_attempt_timeout(retry.remaining()),
+            )
+            response.raise_for_status()
+            body = response.json()
+            text = _extract_response_text(body)
+            if not text:
+                raise UpstreamResponseError("OpenRouter returned empty text")
+            breaker.record_success()
+            completion_latency.record(model_name, time.monotonic() - started)
+            if cache_key:
+                await _cache_set(cache_key, text)
+            return text
+        except (httpx.HTTPError, ValueError) as exc:
+            breaker.record_failure(exc)
+            delay = retry.next_delay(exc)
+            _log_attempt_failure(retry.attempt, retry.max_attempts, exc, delay)
+            if delay is None:
+                raise RuntimeError(f"OpenRouter request failed after {retry.attempt} attempts: {exc}") from exc
+            await asyncio.sleep(delay)
+
+
+async def _generate_single_async(
+    api_key: str,
+    model_name: str,
+    prompt: str,
+    system_instruction: Optional[str],
+    file_path: Optional[str],
+    conversation_history: Optional[list[dict[str, Any]]],
+    referer: str,
+    app_name: str,
+    max_retries: int,
+    use_cache: Optional[bool],
+    file_key: Optional[str],
+    file_data: Optional[bytes] = None,
+) -> str:
+    # File parsing is blocking disk/CPU work; keep it off the event loop.
+    file_parts = (
+        await asyncio.to_thread(_file_content_parts, file_path, model_name, file_key, file_data)
+        if file_path
+        else None
+    )
+    payload = {
+        "model": model_name,
+        "messages": _build_messages(model_name, prompt, system_instruction, file_parts, conversation_history),
+    }
+    headers = _build_headers(api_key, referer, app_name)
+    if not _should_cache(use_cache, file_path, conversation_history):
+        return await _post_completion(model_name, payload, headers, max_retries, None)
+
+    cache_key = make_cache_key(model_name, payload["messages"], system_instruction)
+    cached = await _cache_get(cache_key)
+    if cached is not None:
+        return cached
+    # Identical cacheable prompts arriving together share one upstream call.
+    return await _inflight_completions.do(
+        cache_key,
+        lambda: _post_completion(model_name, payload, headers, max_retries, cache_key),
+    )
+
+
+async def generate_response_async(
+    api_key: str,
+    model_name: str,
+    prompt: str,
+    system_instruction: Optional[str] = None,
+    file_path: Optional[str] = None,
+    conversation_history: Optional[list[dict[str, Any]]] = None,
+    referer: str = "",
+    app_name: str = "Telegram Agent",
+    max_retries: int = MAX_RETRIES,
+    use_cache: Optional[bool] = None,
+    file_key: Optional[str] = None,
+    fallback_models: Optional[list[str]] = None,
+    file_data: Optional[bytes] = None,
+    hedge: bool = False,
+) -> str:
+    if not api_key:
+        raise ValueError("OPENROUTER_API_KEY is not configured")
+
+    async def call(model: str) -> str:
+        return await _generate_single_async(
+            api_key,
+            model,
+            prompt,
+            system_instruction,
+            file_path,
+            conversation_history,
+            referer,
+            app_name,
+            max_retries,
+            use_cache,
+            file_key,
+            file_data,
+        )
+
+    return await _run_with_fallbacks(_model_chain(model_name, fallback_models), call, hedge)
+
+
+async def _stream_single(
+    api_key: str,
+    model_name: str,
+    prompt: str,
+    system_instruction: Optional[str],
+    file_path: Optional[str],
+    conversation_history: Optional[list[dict[str, Any]]],
+    referer: str,
+    app_name: str,
+    max_retries: int,
+    use_cache: Optional[bool],
+    file_key: Optional[str],
+    file_data: Optional[bytes] = None,
+) -> AsyncIterator[str]:
+    file_parts = (
+        await asyncio.to_thread(_file_content_parts, file_path, model_name, file_key, file_data)
+        if file_path
+        else None
+    )
+    payload = {
+        "model": model_name,
+        "messages": _build_messages(model_name, prompt, system_instruction, file_parts, conversation_history),
+        "stream": True,
+    }
+    cache_key = None
+    if _should_cache(use_cache, file_path, conversation_history):
+        cache_key = make_cache_key(model_name, payload["messages"], system_instruction)
+        cached = await _cache_get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+    headers = _build_headers(api_key, referer, app_name)
+    client = _get_async_client()
+    breaker = _circuit_breaker(model_name)
+
+    retry = retry_policy.start(max_retries)
+    while True:
+        breaker.before_call()
+        started = time.monotonic()
+        yielded = False
+        parts: list[str] = []
+        try:
+            async with client.stream(
+                "POST",
+                OPENROUTER_URL,
+                headers=headers,
+                json=payload,
+                timeout=_attempt_timeout(retry.remaining()),
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    # Blank lines separate events; lines starting with ":" are keep-alive comments.
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except json.JSONDecodeError:
+                        continue
+                    delta = _extract_stream_delta(chunk)
+                    if delta:
+                        if not yielded:
+                            first_token_latency.record(model_name, time.monotonic() - started)
+                        yielded = True
+                        parts.append(delta)
+                        yield delta
+            if not yielded:
+                raise UpstreamResponseError("OpenRouter returned empty text")
+            breaker.record_success()
+            if cache_key:
+                await _cache_set(cache_key, "".join(parts).strip())
+            return
+        except (httpx.HTTPError, ValueError) as exc:
+            breaker.record_failure(exc)
+            if yielded:
+                raise
+            delay = retry.next_delay(exc)
+            _log_attempt_failure(retry.attempt, retry.max_attempts, exc, delay)
+            if delay is None:
+                raise RuntimeError(f"OpenRouter request failed after {retry.attempt} attempts: {exc}") from exc
+            await asyncio.sleep(delay)
+
+
+async def stream_response_async(
+    api_key: str,
+    model_name: str,
+    prompt: str,
+    system_instruction: Optional[str] = None,
+    file_path: Optional[str] = None,
+    conversation_history: Optional[list[dict[str, Any]]] = None,
+    referer: str = "",
+    app_name: str = "Telegram Agent",
+    max_retries: int = MAX_RETRIES,
+    use_cache: Optional[bool] = None,
+    file_key: Optional[str] = None,
+    fallback_models: Optional[list[str]] = None,
+    file_data: Optional[bytes] = None,
+) -> AsyncIterator[str]:
+    """Yield completion text deltas as OpenRouter streams them (SSE).
+
+    Retries and model fallbacks only happen before the first delta is
+    yielded; once text has reached the caller a failure is raised as-is.
+    """
+    if not api_key:
+        raise ValueError("OPENROUTER_API_KEY is not configured")
+
+    chain = _model_chain(model_name, fallback_models)
+    for index, model in enumerate(chain):
+        yielded = False
+        try:
+            async for delta in _stream_single(
+                api_key,
+                model,
+                prompt,
+                system_instruction,
+                file_path,
+                conversation_history,
+                referer,
+                app_name,
+                max_retries,
+                use_cache,
+                file_key,
+                file_data,
+            ):
+                yielded = True
+                yield delta
+            return
+        except Exception as exc:
+            if yielded or index == len(chain) - 1:
+                raise
+            logger.warning("Model %s failed, falling back to %s: %s", model, chain[index + 1], exc)
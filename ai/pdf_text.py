@@ -0,0 +1,88 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import fitz
+
+logger = logging.getLogger(__name__)
+
+MAX_CHARS = 6000
+MAX_SAMPLED_PAGES = 12
+HEAD_PAGES = 2
+MIN_CHARS_PER_PAGE = 1000
+CACHE_MAX_ENTRIES = 128
+
+_cache: OrderedDict[tuple[str, int], str] = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _sample_pages(page_count: int, max_pages: int = MAX_SAMPLED_PAGES) -> list[int]:
+    """Pick the first pages plus evenly spaced pages from the rest of the document."""
+    if page_count <= max_pages:
+        return list(range(page_count))
+
+    head = list(range(min(HEAD_PAGES, max_pages)))
+    remaining_slots = max_pages - len(head)
+    start = len(head)
+    last = page_count - 1
+    if remaining_slots == 1:
+        return head + [last]
+    spread = [start + (i * (last - start)) // (remaining_slots - 1) for i in range(remaining_slots)]
+    return sorted(set(head + spread))
+
+
+def _extract(file_path: str, max_chars: int, data: Optional[bytes] = None) -> str:
+    doc = fitz.open(stream=data, filetype="pdf") if data is not None else fitz.open(file_path)
+    with doc:
+        page_count = doc.page_count
+        pages = _sample_pages(page_count)
+        per_page_chars = max(max_chars // max(len(pages), 1), MIN_CHARS_PER_PAGE)
+        multi_page = len(pages) < page_count
+
+        chunks: list[str] = []
+        total = 0
+        for index in pages:
+            page_text = doc.load_page(index).get_text("text").strip()
+            if not page_text:
+                continue
+            page_text = page_text[:per_page_chars]
+            if multi_page:
+                page_text = f"[Page {index + 1}/{page_count}]\n{page_text}"
+            chunks.append(page_text)
+            total += len(page_text)
+            if total >= max_chars:
+                break
+
+    return "\n\n".join(chunks).strip()[:max_chars]
+
+
+def extract_pdf_text(
+    file_path: str,
+    max_chars: int = MAX_CHARS,
+    cache_key: Optional[str] = None,
+    data: Optional[bytes] = None,
+) -> str:
+    """Extract up to ``max_chars`` of text sampled across the whole PDF.
+
+    Results are cached by ``cache_key`` (Telegram's ``file_unique_id``) so a
+    repeat question about the same document skips parsing entirely. Pass the
+    PDF as ``data`` to parse it from memory instead of ``file_path``.
+    """
+    key = (cache_key, max_chars) if cache_key else None
+    if key is not None:
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached is not None:
+                _cache.move_to_end(key)
+                return cached
+
+    text = _extract(file_path, max_chars, data)
+
+    if key is not None:
+        with _cache_lock:
+            _cache[key] = text
+            _cache.move_to_end(key)
+            while len(_cache) > CACHE_MAX_ENTRIES:
+                _cache.popitem(last=False)
+    return text
@@ -0,0 +1,168 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without contacting the upstream while the circuit is open."""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"OpenRouter circuit open; retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class UpstreamResponseError(ValueError):
+    """The upstream answered 2xx but the body was empty or malformed."""
+
+
+def _status_code(exc: Exception) -> Optional[int]:
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def parse_retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def is_retryable(exc: Exception) -> bool:
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    # No HTTP status: transport errors, timeouts, empty or malformed bodies.
+    return True
+
+
+def is_upstream_failure(exc: Exception) -> bool:
+    """Whether ``exc`` says the provider is unhealthy (vs. a bad request of ours)."""
+    return is_retryable(exc)
+
+
+class RetryPolicy:
+    """Retry schedule with decorrelated jitter and an overall deadline."""
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 20.0,
+        deadline: float = 120.0,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def start(self, max_attempts: Optional[int] = None) -> "RetryState":
+        return RetryState(self, max_attempts or self.max_attempts)
+
+
+class RetryState:
+    def __init__(self, policy: RetryPolicy, max_attempts: int):
+        self.policy = policy
+        self.max_attempts = max_attempts
+        self.attempt = 0
+        self._delay = policy.base_delay
+        self._started = time.monotonic()
+
+    def remaining(self) -> float:
+        return max(0.0, self.policy.deadline - (time.monotonic() - self._started))
+
+    def next_delay(self, exc: Exception) -> Optional[float]:
+        """Record a failed attempt; return seconds to wait, or None to give up."""
+        self.attempt += 1
+        if self.attempt >= self.max_attempts or not is_retryable(exc):
+            return None
+
+        retry_after = parse_retry_after(exc)
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            self._delay = min(
+                self.policy.max_delay,
+                random.uniform(self.policy.base_delay, self._delay * 3),
+            )
+            delay = self._delay
+
+        if delay >= self.remaining():
+            return None
+        return delay
+
+
+class CircuitBreaker:
+    """Shared closed/open/half-open breaker for one upstream.
+
+    After ``failure_threshold`` consecutive upstream failures calls fail fast
+    for ``reset_timeout`` seconds; then a single probe call is let through and
+    its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            elapsed = now - self._opened_at
+            if elapsed < self.reset_timeout:
+                raise CircuitOpenError(self.reset_timeout - elapsed)
+            # Half-open: one probe at a time; a probe that never reported back expires.
+            if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+                raise CircuitOpenError(self.reset_timeout)
+            self._probe_started = now
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("OpenRouter circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self, exc: Exception) -> None:
+        if not is_upstream_failure(exc):
+            # The provider answered; the request itself was bad.
+            self.record_success()
+            return
+        with self._lock:
+            self._failures += 1
+            half_open = self._probe_started is not None
+            if half_open or self._failures >= self.failure_threshold:
+                if self._opened_at is None or half_open:
+                    logger.warning("OpenRouter circuit opened after %d failures", self._failures)
+                self._opened_at = time.monotonic()
+                self._probe_started = None
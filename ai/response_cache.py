@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "Temp/ai_response_cache.db"
+MAX_MEMORY_ENTRIES = 512
+TTL_SECONDS = 3600
+
+
+def _normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _normalize_content(content: Any) -> Any:
+    if isinstance(content, str):
+        return _normalize_text(content)
+    if isinstance(content, list):
+        normalized: list[Any] = []
+        for part in content:
+            if isinstance(part, dict) and part.get("type") == "text" and isinstance(part.get("text"), str):
+                normalized.append({"type": "text", "text": _normalize_text(part["text"])})
+            else:
+                normalized.append(part)
+        return normalized
+    return content
+
+
+def make_cache_key(model_name: str, messages: list[dict[str, Any]], system_instruction: Optional[str] = None) -> str:
+    # The system instruction is hashed on its own below; any other system
+    # message (such as the rolling history summary) stays part of the key.
+    if system_instruction and messages and messages[0] == {"role": "system", "content": system_instruction}:
+        messages = messages[1:]
+    normalized_messages = [
+        {"role": message.get("role"), "content": _normalize_content(message.get("content"))}
+        for message in messages
+    ]
+    material = json.dumps(
+        {
+            "model": model_name,
+            "system": _normalize_text(system_instruction or ""),
+            "messages": normalized_messages,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL cache of completion texts, with an optional SQLite tier.
+
+    The in-memory tier is bounded to ``max_entries``; the SQLite tier (when
+    ``db_path`` is set) survives restarts and is consulted on memory misses.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = MAX_MEMORY_ENTRIES,
+        ttl_seconds: int = TTL_SECONDS,
+        db_path: Optional[str] = DB_PATH,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        # One connection for the cache's lifetime, shared by the to_thread workers.
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.persistent_hits = 0
+
+    @property
+    def persistent(self) -> bool:
+        return bool(self.db_path)
+
+    def _connection(self) -> sqlite3.Connection:
+        """The shared connection, opened (and the schema created) on first use; hold ``_db_lock``."""
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    cache_key TEXT PRIMARY KEY,
+                    stored_at REAL NOT NULL,
+                    response TEXT NOT NULL
+                )
+                """
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key: str, stored_at: float, text: str) -> None:
+        self._entries[key] = (stored_at, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, text = entry
+                if now - stored_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return text
+                del self._entries[key]
+
+        text = self._get_persistent(key, now)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.persistent_hits += 1
+            self._remember(key, now, text)
+        return text
+
+    def _get_persistent(self, key: str, now: float) -> Optional[str]:
+        if not self.persistent:
+            return None
+        try:
+            with self._db_lock:
+                row = self._connection().execute(
+                    "SELECT stored_at, response FROM responses WHERE cache_key = ?",
+                    (key,),
+                ).fetchone()
+        except sqlite3.Error as exc:
+            logger.warning("Response cache read failed: %s", exc)
+            return None
+        if not row or (now - row[0]) > self.ttl_seconds:
+            return None
+        return row[1]
+
+    def set(self, key: str, text: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, text)
+        if not self.persistent:
+            return
+        try:
+            with self._db_lock, self._connection() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO responses (cache_key, stored_at, response)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(cache_key) DO UPDATE SET
+                        stored_at = excluded.stored_at,
+                        response = excluded.response
+                    """,
+                    (key, now, text),
+                )
+                conn.execute("DELETE FROM responses WHERE stored_at < ?", (now - self.ttl_seconds,))
+        except sqlite3.Error as exc:
+            logger.warning("Response cache write failed: %s", exc)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.persistent_hits = 0
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "persistent_hits": self.persistent_hits,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENCY = 8
+MAX_QUEUE_DEPTH = 200
+MAX_QUEUED_PER_USER = 3
+
+
+class SchedulerBusyError(RuntimeError):
+    """Raised instead of queueing when the queue (or the user's share of it) is full."""
+
+
+class AIScheduler:
+    """Caps concurrent AI calls and hands out free slots round-robin per user.
+
+    Each user has a FIFO of waiters; when a slot frees up the next user in
+    the rotation that has a waiter gets it, so one user's burst cannot starve
+    everyone else. With unit cost per request this is deficit round robin
+    with a quantum of one.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_queue_depth: int = MAX_QUEUE_DEPTH,
+        max_queued_per_user: int = MAX_QUEUED_PER_USER,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.max_queued_per_user = max_queued_per_user
+        self._in_flight = 0
+        self._queues: dict[int, deque[asyncio.Future]] = {}
+        self._rotation: deque[int] = deque()
+        self._tasks: dict[int, set[asyncio.Task]] = {}
+        self._cancelled: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _position_for(self, user_id: int) -> int:
+        """1-based queue position a new waiter of ``user_id`` would get."""
+        own = len(self._queues.get(user_id, ()))
+        ahead = own
+        for other, queue in self._queues.items():
+            if other != user_id:
+                ahead += min(len(queue), own + 1)
+        return ahead + 1
+
+    def _dispatch(self) -> None:
+        while self._in_flight < self.max_concurrency and self._rotation:
+            user_id = self._rotation.popleft()
+            queue = self._queues.get(user_id)
+            waiter = None
+            while queue:
+                candidate = queue.popleft()
+                if not candidate.done():
+                    waiter = candidate
+                    break
+            if queue:
+                self._rotation.append(user_id)
+            else:
+                self._queues.pop(user_id, None)
+            if waiter is not None:
+                self._in_flight += 1
+                waiter.set_result(None)
+
+    async def _acquire(self, user_id: int, on_queued: Optional[Callable[[int], Awaitable[None]]]) -> None:
+        if self._in_flight < self.max_concurrency and not self._rotation:
+            self._in_flight += 1
+            return
+
+        if self.queue_depth >= self.max_queue_depth:
+            raise SchedulerBusyError("AI queue is full")
+        if len(self._queues.get(user_id, ())) >= self.max_queued_per_user:
+            raise SchedulerBusyError("Too many queued requests for this user")
+
+        position = self._position_for(user_id)
+        waiter = asyncio.get_running_loop().create_future()
+        if user_id not in self._queues:
+            self._queues[user_id] = deque()
+            self._rotation.append(user_id)
+        self._queues[user_id].append(waiter)
+
+        try:
+            if on_queued is not None:
+                await on_queued(position)
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # Granted a slot at the same moment we were cancelled: hand it back.
+                self._release()
+            else:
+                waiter.cancel()
+                self._forget(user_id, waiter)
+            raise
+
+    def _forget(self, user_id: int, waiter: asyncio.Future) -> None:
+        queue = self._queues.get(user_id)
+        if not queue:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            self._queues.pop(user_id, None)
+            try:
+                self._rotation.remove(user_id)
+            except ValueError:
+                pass
+
+    def try_acquire_extra(self) -> bool:
+        """Take one more slot for secondary work (a hedged request) if one is free now.
+
+        Never waits and never goes ahead of queued users; release with
+        ``release_extra``.
+        """
+        if self._in_flight < self.max_concurrency and not self._rotation:
+            self._in_flight += 1
+            return True
+        return False
+
+    def release_extra(self) -> None:
+        self._release()
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user_id: int,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> AsyncIterator[None]:
+        """Wait for a fair turn, then hold one concurrency slot for the block.
+
+        ``on_queued`` is awaited with the 1-based queue position when the call
+        has to wait. The current task is registered so ``cancel_user`` can
+        stop it both while queued and while running.
+        """
+        task = asyncio.current_task()
+        self._tasks.setdefault(user_id, set()).add(task)
+        try:
+            await self._acquire(user_id, on_queued)
+            try:
+                yield
+            finally:
+                self._release()
+        finally:
+            tasks = self._tasks.get(user_id)
+            if tasks is not None:
+                tasks.discard(task)
+                if not tasks:
+                    self._tasks.pop(user_id, None)
+
+    def cancel_user(self, user_id: int) -> int:
+        """Cancel every queued or running AI call of ``user_id``; return how many."""
+        tasks = list(self._tasks.get(user_id, ()))
+        for task in tasks:
+            self._cancelled.add(task)
+            task.cancel()
+        if tasks:
+            logger.info("Cancelled %d AI request(s) for user %s", len(tasks), user_id)
+        return len(tasks)
+
+    def consume_cancellation(self, task: Optional[asyncio.Task] = None) -> bool:
+        """Whether ``task`` (default: current) was cancelled via ``cancel_user``."""
+        task = task or asyncio.current_task()
+        if task in self._cancelled:
+            self._cancelled.discard(task)
+            return True
+        return False
+
+
+ai_scheduler = AIScheduler()
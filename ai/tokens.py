@@ -0,0 +1,34 @@
+import math
+
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Prompt-side history budgets; unlisted models fall back to the default.
+DEFAULT_HISTORY_TOKEN_BUDGET = 3000
+MODEL_HISTORY_TOKEN_BUDGETS = {
+    "openai/gpt-4.1-mini": 6000,
+    "openai/gpt-4.1": 8000,
+    "openai/gpt-4o-mini": 4000,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate without a tokenizer.
+
+    ASCII text averages ~4 characters per token for GPT-style tokenizers;
+    other scripts (e.g. Devanagari) tokenize far less efficiently, so they
+    are counted closer to one token per character.
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    other_chars = len(text) - ascii_chars
+    return math.ceil(ascii_chars / 4 + other_chars / 1.5)
+
+
+def estimate_message_tokens(text: str) -> int:
+    return estimate_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+
+def history_token_budget(model_name: str) -> int:
+    """Tokens of conversation history (summary included) sent to ``model_name``."""
+    return MODEL_HISTORY_TOKEN_BUDGETS.get(model_name, DEFAULT_HISTORY_TOKEN_BUDGET)
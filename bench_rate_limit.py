@@ -0,0 +1,92 @@
+"""Compare the legacy timestamp-list rate limiting with the constant-size limiters.
+
+Simulates the file-operation limit (100 per hour) for many users, each kept
+close to the limit, and reports time per check+record, memory per user and
+the bytes written to SQLite per save.
+
+    python bench_rate_limit.py [users] [rounds]
+"""
+import json
+import sys
+import time
+import tracemalloc
+
+from rate_limit import make_limiter
+
+LIMIT = 100
+WINDOW = 3600.0
+
+
+def _legacy_check_and_record(timestamps: list[float], now: float) -> tuple[bool, list[float]]:
+    # Mirrors the old UserSession._clean_old_timestamps + len() check.
+    cutoff = now - WINDOW
+    timestamps = [ts for ts in timestamps if ts > cutoff]
+    if len(timestamps) >= LIMIT:
+        return False, timestamps
+    timestamps.append(now)
+    return True, timestamps
+
+
+def bench_legacy(users: int, rounds: int, start: float) -> dict:
+    states = {uid: [start - WINDOW + i * (WINDOW / LIMIT) for i in range(LIMIT - 1)] for uid in range(users)}
+    began = time.perf_counter()
+    for step in range(rounds):
+        now = start + step
+        for uid in range(users):
+            _, states[uid] = _legacy_check_and_record(states[uid], now)
+    elapsed = time.perf_counter() - began
+    return _report("list", states, elapsed, users * rounds, lambda state: json.dumps(state))
+
+
+def bench_limiter(algorithm: str, users: int, rounds: int, start: float) -> dict:
+    limiter = make_limiter(algorithm, LIMIT, WINDOW)
+    seed = limiter.from_timestamps(start - WINDOW + i * (WINDOW / LIMIT) for i in range(LIMIT - 1))
+    states = {uid: seed for uid in range(users)}
+    began = time.perf_counter()
+    for step in range(rounds):
+        now = start + step
+        for uid in range(users):
+            state = states[uid]
+            if limiter.used(state, now) < LIMIT:
+                states[uid] = limiter.consume(state, now)
+    elapsed = time.perf_counter() - began
+    return _report(algorithm, states, elapsed, users * rounds, lambda state: json.dumps(state))
+
+
+def _report(name: str, states: dict, elapsed: float, ops: int, serialize) -> dict:
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    copies = {uid: json.loads(serialize(state)) for uid, state in states.items()}
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in snapshot_after.compare_to(snapshot_before, "filename"))
+    serialized = sum(len(serialize(state)) for state in states.values())
+    del copies
+    return {
+        "name": name,
+        "us_per_op": elapsed / ops * 1e6,
+        "bytes_per_user": allocated / len(states),
+        "serialized_bytes_per_user": serialized / len(states),
+    }
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    start = time.time()
+    results = [
+        bench_legacy(users, rounds, start),
+        bench_limiter("gcra", users, rounds, start),
+        bench_limiter("token_bucket", users, rounds, start),
+    ]
+    print(f"{users} users x {rounds} rounds, limit {LIMIT}/{WINDOW:.0f}s")
+    print(f"{'engine':<14}{'us/op':>10}{'mem B/user':>14}{'json B/user':>14}")
+    for row in results:
+        print(
+            f"{row['name']:<14}{row['us_per_op']:>10.2f}"
+            f"{row['bytes_per_user']:>14.0f}{row['serialized_bytes_per_user']:>14.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -8,11 +8,24 @@ dotenv.load_dotenv()
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "")
 OPENROUTER_MODEL = os.environ.get("MODEL_NAME", "openai/gpt-4.1-mini")
+OPENROUTER_FALLBACK_MODELS = [
+    name.strip() for name in os.environ.get("FALLBACK_MODEL_NAMES", "").split(",") if name.strip()
+]
+OPENROUTER_HEDGING = os.environ.get("OPENROUTER_HEDGING", "0").lower() in {"1", "true", "yes"}
 OPENROUTER_REFERER = os.environ.get("OPENROUTER_REFERER", "")
 OPENROUTER_APP_NAME = os.environ.get("OPENROUTER_APP_NAME", "Telegram Agent")
+OPENROUTER_STREAMING = os.environ.get("OPENROUTER_STREAMING", "1").lower() not in {"0", "false", "no"}
+
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite").lower()
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+# Telegram's Bot API serves files up to 20 MB; smaller ones are kept in memory.
+MAX_DOWNLOAD_BYTES = int(os.environ.get("MAX_DOWNLOAD_MB", "20")) * 1024 * 1024
+IN_MEMORY_DOWNLOAD_BYTES = int(os.environ.get("IN_MEMORY_DOWNLOAD_MB", "8")) * 1024 * 1024
 
 OUTPUT_DIR = "Temp/Output"
 MAX_TELEGRAM_MSG_LEN = 4096
+STREAM_EDIT_INTERVAL_SECONDS = 1.5
 
 HELP_TEXT = """
 *Available Commands:*
@@ -22,9 +35,11 @@ Send any message and I'll respond with AI assistance.
 
 *File Operations*
 `/compress_image` `/ci` - Compress an image
+  Optional: target size in KB and format, e.g. `/ci 300 webp`
 `/compress_pdf` `/cpdf` - Compress a PDF
 `/to_pdf` `/tp` - Convert image to PDF
 `/to_images` `/ti` - Convert PDF to images
+  Optional: pages and quality, e.g. `/ti 3-10 dpi=150 quality=80`; add `zip` for one archive
 
 *Utility*
 `/hbtu_updates` `/hu` - Check HBTU circulars
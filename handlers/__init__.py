@@ -9,8 +9,10 @@ from .commands import (
     to_pdf_command,
 )
 from .messages import handle_media, handle_message
+from .update_processor import PerUserUpdateProcessor
 
 __all__ = [
+    "PerUserUpdateProcessor",
     "cancel_command",
     "compress_image_command",
     "compress_pdf_command",
@@ -1,30 +1,94 @@
 import asyncio
 import logging
+import re
+from typing import Optional
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from config import HELP_TEXT, OPENROUTER_API_KEY, OPENROUTER_MODEL
-from hbtu_updates.cheking_update import check_for_updates
-from services.hbtu_service import format_hbtu_updates
+from ai.scheduler import SchedulerBusyError, ai_scheduler
+from config import HELP_TEXT, OPENROUTER_API_KEY, OPENROUTER_FALLBACK_MODELS, OPENROUTER_MODEL
+from services.file_jobs import file_job_queue
+from services.hbtu_service import fetch_hbtu_updates, format_hbtu_updates
 from session_manager import ActionState, SessionManager
 
 logger = logging.getLogger(__name__)
 
-
-def _set_action_state(update: Update, state: ActionState, message: str) -> str:
+TO_IMAGES_USAGE = (
+    "Usage: /to_images [pages] [dpi=N] [quality=N] [zip]\n"
+    "e.g. /to_images 3-10 dpi=150 quality=80"
+)
+COMPRESS_IMAGE_USAGE = (
+    "Usage: /compress_image [target KB] [jpeg|webp]\n"
+    "e.g. /compress_image 300 webp"
+)
+COMPRESS_IMAGE_SIZE_RANGE = (20, 10000)
+TO_IMAGES_DPI_RANGE = (50, 300)
+TO_IMAGES_QUALITY_RANGE = (30, 95)
+_PAGE_RANGE = re.compile(r"(\d+)(?:-(\d+))?")
+
+
+async def _set_action_state(update: Update, state: ActionState, message: str, params: Optional[dict] = None) -> str:
     if not update.message:
         return message
     user_id = update.message.from_user.id
-    SessionManager().set_action(user_id, state)
+    await SessionManager().aset_action(user_id, state, params)
     return message
 
 
+def _parse_compress_image_args(args: list[str]) -> tuple[dict, Optional[str]]:
+    """Parse ``[target KB] [jpeg|webp]``; return ``(params, error)``."""
+    params: dict = {}
+    for arg in args:
+        value = arg.lower().removesuffix("kb")
+        if value in {"jpeg", "jpg", "webp"}:
+            params["output_format"] = "webp" if value == "webp" else "jpeg"
+        elif value.isdigit():
+            low, high = COMPRESS_IMAGE_SIZE_RANGE
+            if not low <= int(value) <= high:
+                return {}, f"Target size must be between {low} and {high} KB.\n{COMPRESS_IMAGE_USAGE}"
+            params["max_size"] = int(value)
+        else:
+            return {}, f"Unknown option '{arg}'.\n{COMPRESS_IMAGE_USAGE}"
+    return params, None
+
+
+def _parse_to_images_args(args: list[str]) -> tuple[dict, Optional[str]]:
+    """Parse ``[pages] [dpi=N] [quality=N] [zip]``; return ``(params, error)``."""
+    params: dict = {}
+    for arg in args:
+        if arg.lower() == "zip":
+            params["zip"] = True
+            continue
+        key, sep, value = arg.lower().partition("=")
+        if sep:
+            if key == "dpi":
+                low, high = TO_IMAGES_DPI_RANGE
+            elif key in {"q", "quality"}:
+                key = "quality"
+                low, high = TO_IMAGES_QUALITY_RANGE
+            else:
+                return {}, f"Unknown option '{arg}'.\n{TO_IMAGES_USAGE}"
+            if not value.isdigit() or not low <= int(value) <= high:
+                return {}, f"{key} must be between {low} and {high}.\n{TO_IMAGES_USAGE}"
+            params[key] = int(value)
+            continue
+        match = _PAGE_RANGE.fullmatch(arg)
+        if not match:
+            return {}, f"Invalid page range '{arg}'.\n{TO_IMAGES_USAGE}"
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if first < 1 or last < first:
+            return {}, f"Invalid page range '{arg}'.\n{TO_IMAGES_USAGE}"
+        params["pages"] = [first, last]
+    return params, None
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.message:
         return
     user_id = update.message.from_user.id
-    ai_quota = SessionManager().get_ai_quota(user_id)
+    ai_quota = await SessionManager().aget_ai_quota(user_id)
     welcome_text = (
         "Hi! I'm ready to assist you.\n\n"
         "Commands:\n"
@@ -44,7 +108,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if not update.message:
         return
     user_id = update.message.from_user.id
-    ai_quota = SessionManager().get_ai_quota(user_id)
+    ai_quota = await SessionManager().aget_ai_quota(user_id)
     await update.message.reply_text(f"{HELP_TEXT}\n\n{ai_quota}")
 
 
@@ -53,11 +117,19 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
     user_id = update.message.from_user.id
     sm = SessionManager()
-    if sm.get_session(user_id).action_state != ActionState.NONE:
-        sm.clear_action(user_id)
+    canceled_ai = ai_scheduler.cancel_user(user_id)
+    canceled_jobs = await file_job_queue.cancel_user(user_id)
+    if (await sm.aget_session(user_id)).action_state != ActionState.NONE:
+        await sm.aclear_action(user_id)
         logger.info("User %s canceled their action.", user_id)
         await update.message.reply_text("Your current action has been canceled.")
         return
+    if canceled_jobs:
+        await update.message.reply_text("Your file job has been canceled.")
+        return
+    if canceled_ai:
+        await update.message.reply_text("Your pending AI request has been canceled.")
+        return
     await update.message.reply_text("You have no active action to cancel.")
 
 
@@ -67,7 +139,7 @@ async def hbtu_updates_command(update: Update, context: ContextTypes.DEFAULT_TYP
 
     user_id = update.message.from_user.id
     sm = SessionManager()
-    allowed, rate_message = sm.check_ai_rate_limit(user_id)
+    allowed, rate_message = await sm.aacquire_ai_request(user_id)
     if not allowed:
         await update.message.reply_text(rate_message)
         return
@@ -75,17 +147,22 @@ async def hbtu_updates_command(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text(rate_message)
 
     await update.message.reply_text("Checking HBTU updates...")
-    sm.record_ai_request(user_id)
 
     try:
-        updates = await asyncio.to_thread(check_for_updates)
-        formatted = await asyncio.to_thread(
-            format_hbtu_updates,
-            updates,
-            OPENROUTER_API_KEY,
-            OPENROUTER_MODEL,
-        )
+        updates = await fetch_hbtu_updates()
+        async with ai_scheduler.slot(user_id):
+            formatted = await format_hbtu_updates(
+                updates,
+                OPENROUTER_API_KEY,
+                OPENROUTER_MODEL,
+                OPENROUTER_FALLBACK_MODELS,
+            )
         await update.message.reply_text(formatted, disable_web_page_preview=True)
+    except SchedulerBusyError:
+        await update.message.reply_text("Too many requests right now. Please try again in a minute.")
+    except asyncio.CancelledError:
+        if not ai_scheduler.consume_cancellation():
+            raise
     except Exception as exc:
         logger.error("HBTU update error for user %s: %s", user_id, exc)
         await update.message.reply_text("An error occurred while checking HBTU updates.")
@@ -94,11 +171,16 @@ async def hbtu_updates_command(update: Update, context: ContextTypes.DEFAULT_TYP
 async def compress_image_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.message:
         return
+    params, error = _parse_compress_image_args(context.args or [])
+    if error:
+        await update.message.reply_text(error)
+        return
     await update.message.reply_text(
-        _set_action_state(
+        await _set_action_state(
             update,
             ActionState.WAITING_FOR_IMAGE_COMPRESS,
             "Please send the image you want to compress.",
+            params,
         )
     )
 
@@ -107,7 +189,7 @@ async def compress_pdf_command(update: Update, context: ContextTypes.DEFAULT_TYP
     if not update.message:
         return
     await update.message.reply_text(
-        _set_action_state(
+        await _set_action_state(
             update,
             ActionState.WAITING_FOR_PDF_COMPRESS,
             "Please send the PDF you want to compress.",
@@ -119,7 +201,7 @@ async def to_pdf_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not update.message:
         return
     await update.message.reply_text(
-        _set_action_state(
+        await _set_action_state(
             update,
             ActionState.WAITING_FOR_IMAGE_TO_PDF,
             "Please send the image to convert to PDF.",
@@ -130,10 +212,15 @@ async def to_pdf_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def to_images_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.message:
         return
+    params, error = _parse_to_images_args(context.args or [])
+    if error:
+        await update.message.reply_text(error)
+        return
     await update.message.reply_text(
-        _set_action_state(
+        await _set_action_state(
             update,
             ActionState.WAITING_FOR_PDF_TO_IMAGES,
             "Please send the PDF to convert into images.",
+            params,
         )
     )
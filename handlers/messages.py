@@ -1,28 +1,44 @@
 import asyncio
 import logging
+from functools import partial
 
-from telegram import Update
+from telegram import Message, Update
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
 
-from ai.openrouter_client import generate_response
+from ai.openrouter_client import generate_response_async, stream_response_async
+from ai.resilience import CircuitOpenError
+from ai.scheduler import SchedulerBusyError, ai_scheduler
 from config import (
     MAX_TELEGRAM_MSG_LEN,
     OPENROUTER_API_KEY,
     OPENROUTER_APP_NAME,
+    OPENROUTER_FALLBACK_MODELS,
+    OPENROUTER_HEDGING,
     OPENROUTER_MODEL,
     OPENROUTER_REFERER,
-    OUTPUT_DIR,
-)
-from services.file_pipeline import (
-    cleanup_paths,
-    extract_file_id_for_action,
-    process_action_file,
-    send_output,
+    OPENROUTER_STREAMING,
 )
+from handlers.streaming import StreamingReply
+from media_extractor import fetch_file, file_size_error
+from services.file_jobs import JobQueueFullError, file_job_queue
+from services.file_pipeline import extract_file_id_for_action, send_cached_result
 from session_manager import ActionState, SessionManager
 
 logger = logging.getLogger(__name__)
 
+AI_UNAVAILABLE_TEXT = "The AI service is temporarily unavailable. Please try again in a minute."
+AI_BUSY_TEXT = "I'm handling too many requests right now. Please try again in a minute."
+AI_ERROR_TEXT = "Sorry, I encountered an error. Please try again."
+STREAM_INTERRUPTED_NOTE = "(response interrupted)"
+
+
+async def _notify_queue_position(message: Message, position: int) -> None:
+    try:
+        await message.reply_text(f"Lots of requests right now. You're #{position} in the queue, hang tight.")
+    except TelegramError as exc:
+        logger.warning("Could not send queue position: %s", exc)
+
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.message or not update.message.text:
@@ -32,20 +48,48 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     text = update.message.text
     sm = SessionManager()
 
-    allowed, message = sm.check_ai_rate_limit(user_id)
+    allowed, message = await sm.aacquire_ai_request(user_id)
     if not allowed:
         await update.message.reply_text(message)
         return
     if message:
         await update.message.reply_text(message)
 
-    sm.record_ai_request(user_id)
-    session = sm.get_session(user_id)
-    history = list(session.history)
+    session = await sm.aget_session(user_id)
+    history = session.get_prompt_history()
 
     try:
-        response_text = await asyncio.to_thread(
-            generate_response,
+        async with ai_scheduler.slot(user_id, partial(_notify_queue_position, update.message)):
+            if OPENROUTER_STREAMING:
+                await _stream_chat_reply(update, sm, user_id, text, history)
+                return
+            response_text = await _chat_response_text(user_id, text, history)
+    except SchedulerBusyError:
+        await update.message.reply_text(AI_BUSY_TEXT)
+        return
+    except asyncio.CancelledError:
+        if ai_scheduler.consume_cancellation():
+            return
+        raise
+
+    await sm.aadd_history(user_id, "user", text)
+    await sm.aadd_history(user_id, "model", response_text)
+    quota_msg = await sm.aget_ai_quota(user_id)
+    if len(response_text) > MAX_TELEGRAM_MSG_LEN:
+        chunks = [
+            response_text[i : i + MAX_TELEGRAM_MSG_LEN]
+            for i in range(0, len(response_text), MAX_TELEGRAM_MSG_LEN)
+        ]
+        for chunk in chunks:
+            await update.message.reply_text(chunk)
+        await update.message.reply_text(quota_msg)
+        return
+    await update.message.reply_text(f"{response_text}\n\n{quota_msg}")
+
+
+async def _chat_response_text(user_id: int, text: str, history: list[dict]) -> str:
+    try:
+        return await generate_response_async(
             OPENROUTER_API_KEY,
             OPENROUTER_MODEL,
             text,
@@ -54,24 +98,62 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             history,
             OPENROUTER_REFERER,
             OPENROUTER_APP_NAME,
+            fallback_models=OPENROUTER_FALLBACK_MODELS,
+            hedge=OPENROUTER_HEDGING,
         )
+    except CircuitOpenError:
+        return AI_UNAVAILABLE_TEXT
     except Exception as exc:
         logger.error("AI response error for user %s: %s", user_id, exc)
-        response_text = "Sorry, I encountered an error. Please try again."
+        return AI_ERROR_TEXT
 
-    sm.add_history(user_id, "user", text)
-    sm.add_history(user_id, "model", response_text)
-    quota_msg = sm.get_ai_quota(user_id)
-    if len(response_text) > MAX_TELEGRAM_MSG_LEN:
-        chunks = [
-            response_text[i : i + MAX_TELEGRAM_MSG_LEN]
-            for i in range(0, len(response_text), MAX_TELEGRAM_MSG_LEN)
-        ]
-        for chunk in chunks:
-            await update.message.reply_text(chunk)
-        await update.message.reply_text(quota_msg)
+
+async def _stream_chat_reply(
+    update: Update,
+    sm: SessionManager,
+    user_id: int,
+    text: str,
+    history: list[dict],
+) -> None:
+    reply = StreamingReply(update.message)
+    await reply.start()
+    try:
+        async for delta in stream_response_async(
+            OPENROUTER_API_KEY,
+            OPENROUTER_MODEL,
+            text,
+            None,
+            None,
+            history,
+            OPENROUTER_REFERER,
+            OPENROUTER_APP_NAME,
+            fallback_models=OPENROUTER_FALLBACK_MODELS,
+        ):
+            await reply.append(delta)
+    except asyncio.CancelledError:
+        try:
+            await reply.finish("Canceled.")
+        except TelegramError:
+            pass
+        raise
+    except CircuitOpenError:
+        error_text = AI_UNAVAILABLE_TEXT
+    except Exception as exc:
+        logger.error("AI streaming error for user %s: %s", user_id, exc)
+        error_text = AI_ERROR_TEXT
+    else:
+        error_text = None
+
+    if error_text is not None:
+        # A cut-off reply is not a complete model turn, so it stays out of the history.
+        await reply.append(f"\n\n{STREAM_INTERRUPTED_NOTE}" if reply.full_text else error_text)
+        await reply.finish(await sm.aget_ai_quota(user_id))
         return
-    await update.message.reply_text(f"{response_text}\n\n{quota_msg}")
+
+    response_text = reply.full_text
+    await sm.aadd_history(user_id, "user", text)
+    await sm.aadd_history(user_id, "model", response_text)
+    await reply.finish(await sm.aget_ai_quota(user_id))
 
 
 async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -79,48 +161,45 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
     user_id = update.message.from_user.id
     sm = SessionManager()
-    action_state = sm.get_session(user_id).action_state
-    if action_state != ActionState.NONE:
-        await _process_file_action(update, context, action_state)
+    session = await sm.aget_session(user_id)
+    if session.action_state != ActionState.NONE:
+        await _process_file_action(update, context, session.action_state, dict(session.action_params))
         return
     await _analyze_file_with_ai(update, context)
 
 
-async def _process_file_action(update: Update, context: ContextTypes.DEFAULT_TYPE, action_state: ActionState) -> None:
+async def _process_file_action(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, action_state: ActionState, params: dict
+) -> None:
     if not update.message:
         return
 
     user_id = update.message.from_user.id
     sm = SessionManager()
 
-    file_id, validation_error = extract_file_id_for_action(update.message, action_state)
+    file_id, file_unique_id, validation_error = extract_file_id_for_action(update.message, action_state)
     if not file_id:
         await update.message.reply_text(validation_error or "Invalid file.")
         return
 
-    allowed, file_msg = sm.check_file_op_rate_limit(user_id)
+    allowed, file_msg = await sm.aacquire_file_op(user_id)
     if not allowed:
         await update.message.reply_text(file_msg)
         return
 
-    sm.record_file_op(user_id)
-    sm.clear_action(user_id)
-    await update.message.reply_text("File received. Processing...")
+    await sm.aclear_action(user_id)
+    if await send_cached_result(context.bot, update.message.chat_id, file_unique_id, action_state, params):
+        return
 
-    input_path = None
-    output_path = None
+    status = await update.message.reply_text("File received. Queued...")
     try:
-        input_path, output_path = await process_action_file(context.bot, file_id, action_state, OUTPUT_DIR)
-        if not output_path:
-            await update.message.reply_text("Action failed or no changes were made.")
-            return
-        await update.message.reply_text("Done. Sending your file(s)...")
-        await send_output(context.bot, user_id, output_path)
-    except Exception as exc:
-        logger.error("File action error for user %s: %s", user_id, exc)
-        await update.message.reply_text(f"An error occurred: {exc}")
-    finally:
-        cleanup_paths(input_path, output_path)
+        await file_job_queue.enqueue(
+            user_id, update.message.chat_id, action_state, file_id, file_unique_id, status.message_id, params
+        )
+    except JobQueueFullError as exc:
+        # The job was never accepted, so it should not cost the user a file op.
+        await sm.arefund_file_op(user_id)
+        await status.edit_text(str(exc))
 
 
 async def _analyze_file_with_ai(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -129,50 +208,55 @@ async def _analyze_file_with_ai(update: Update, context: ContextTypes.DEFAULT_TY
 
     user_id = update.message.from_user.id
     sm = SessionManager()
-    allowed, message = sm.check_ai_rate_limit(user_id)
-    if not allowed:
-        await update.message.reply_text(message)
-        return
-    if message:
-        await update.message.reply_text(message)
-
-    file_id = None
+    media = None
     if update.message.photo:
-        file_id = update.message.photo[-1].file_id
+        media = update.message.photo[-1]
     elif update.message.document:
-        file_id = update.message.document.file_id
+        media = update.message.document
 
-    if not file_id:
+    if not media:
         await update.message.reply_text("Unsupported file type.")
         return
+    size_error = file_size_error(media.file_size)
+    if size_error:
+        await update.message.reply_text(size_error)
+        return
+
+    allowed, message = await sm.aacquire_ai_request(user_id)
+    if not allowed:
+        await update.message.reply_text(message)
+        return
+    if message:
+        await update.message.reply_text(message)
 
     prompt = update.message.caption or "Describe this file and solve any questions found."
     await update.message.reply_text("File received, analyzing...")
-    sm.record_ai_request(user_id)
-    history = list(sm.get_session(user_id).history)
+    history = (await sm.aget_session(user_id)).get_prompt_history()
 
-    file_path = None
+    fetched = None
     try:
-        from media_extractor import extract_file
-
-        file_path = await extract_file(context.bot, file_id)
-        if not file_path:
+        fetched = await fetch_file(context.bot, media.file_id)
+        if not fetched:
             await update.message.reply_text("Failed to download file.")
             return
 
-        response_text = await asyncio.to_thread(
-            generate_response,
-            OPENROUTER_API_KEY,
-            OPENROUTER_MODEL,
-            prompt,
-            None,
-            file_path,
-            history,
-            OPENROUTER_REFERER,
-            OPENROUTER_APP_NAME,
-        )
-        sm.add_history(user_id, "user", prompt)
-        sm.add_history(user_id, "model", response_text)
+        async with ai_scheduler.slot(user_id, partial(_notify_queue_position, update.message)):
+            response_text = await generate_response_async(
+                OPENROUTER_API_KEY,
+                OPENROUTER_MODEL,
+                prompt,
+                None,
+                fetched.path or fetched.name,
+                history,
+                OPENROUTER_REFERER,
+                OPENROUTER_APP_NAME,
+                file_key=media.file_unique_id,
+                fallback_models=OPENROUTER_FALLBACK_MODELS,
+                file_data=fetched.data,
+                hedge=OPENROUTER_HEDGING,
+            )
+        await sm.aadd_history(user_id, "user", prompt)
+        await sm.aadd_history(user_id, "model", response_text)
 
         chunks = [
             response_text[i : i + MAX_TELEGRAM_MSG_LEN]
@@ -181,9 +265,17 @@ async def _analyze_file_with_ai(update: Update, context: ContextTypes.DEFAULT_TY
         for chunk in chunks:
             await update.message.reply_text(chunk)
 
-        await update.message.reply_text(sm.get_ai_quota(user_id))
+        await update.message.reply_text(await sm.aget_ai_quota(user_id))
+    except SchedulerBusyError:
+        await update.message.reply_text(AI_BUSY_TEXT)
+    except asyncio.CancelledError:
+        if not ai_scheduler.consume_cancellation():
+            raise
+    except CircuitOpenError:
+        await update.message.reply_text(AI_UNAVAILABLE_TEXT)
     except Exception as exc:
         logger.error("AI file analysis error for user %s: %s", user_id, exc)
         await update.message.reply_text("An error occurred while analyzing the file.")
     finally:
-        cleanup_paths(file_path, None)
+        if fetched:
+            fetched.cleanup()
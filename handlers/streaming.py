@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from config import MAX_TELEGRAM_MSG_LEN, STREAM_EDIT_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_TEXT = "…"
+
+
+class StreamingReply:
+    """Progressively edits a Telegram reply as streamed text arrives.
+
+    Edits are throttled to one per ``edit_interval`` seconds; when the
+    current message fills up to ``MAX_TELEGRAM_MSG_LEN`` it is finalized and
+    a new message is started for the remainder.
+    """
+
+    def __init__(self, source: Message, edit_interval: float = STREAM_EDIT_INTERVAL_SECONDS):
+        self._source = source
+        self._edit_interval = edit_interval
+        self._current: Message | None = None
+        self._pending = ""
+        self._shown = ""
+        self._last_edit = 0.0
+        self.full_text = ""
+
+    async def start(self) -> None:
+        self._current = await self._source.reply_text(PLACEHOLDER_TEXT)
+        self._last_edit = time.monotonic()
+
+    async def append(self, delta: str) -> None:
+        self.full_text += delta
+        self._pending += delta
+
+        while len(self._pending) > MAX_TELEGRAM_MSG_LEN:
+            head = self._pending[:MAX_TELEGRAM_MSG_LEN]
+            self._pending = self._pending[MAX_TELEGRAM_MSG_LEN:]
+            await self._edit(head, force=True)
+            self._current = await self._source.reply_text(self._pending[:MAX_TELEGRAM_MSG_LEN] or PLACEHOLDER_TEXT)
+            self._shown = self._pending[:MAX_TELEGRAM_MSG_LEN]
+            self._last_edit = time.monotonic()
+
+        if time.monotonic() - self._last_edit >= self._edit_interval:
+            await self._edit(self._pending)
+
+    async def finish(self, footer: str = "") -> None:
+        text = self._pending or PLACEHOLDER_TEXT
+        if footer and len(text) + len(footer) + 2 <= MAX_TELEGRAM_MSG_LEN:
+            await self._edit(f"{text}\n\n{footer}", force=True)
+            return
+        await self._edit(text, force=True)
+        if footer:
+            await self._source.reply_text(footer)
+
+    async def _edit(self, text: str, force: bool = False) -> None:
+        if self._current is None or not text or text == self._shown:
+            return
+        try:
+            await self._try_edit(text, retry_flood=force)
+        finally:
+            self._last_edit = time.monotonic()
+
+    async def _try_edit(self, text: str, retry_flood: bool) -> None:
+        try:
+            await self._current.edit_text(text)
+            self._shown = text
+        except RetryAfter as exc:
+            # Flood control: skip intermediate edits, but the final text must land.
+            if retry_flood:
+                await asyncio.sleep(_retry_after_seconds(exc.retry_after))
+                await self._try_edit(text, retry_flood=False)
+        except BadRequest as exc:
+            if "not modified" not in str(exc).lower():
+                logger.warning("Streaming edit rejected: %s", exc)
+        except TelegramError as exc:
+            logger.warning("Streaming edit failed: %s", exc)
+
+
+def _retry_after_seconds(retry_after) -> float:
+    # python-telegram-bot reports this as int seconds or a timedelta depending on version.
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
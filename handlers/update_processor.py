@@ -0,0 +1,47 @@
+import asyncio
+import weakref
+from typing import Any, Awaitable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+MAX_CONCURRENT_UPDATES = 256
+# Commands that must reach the bot while the same user's earlier update is still running.
+UNORDERED_COMMANDS = frozenset({"/cancel"})
+
+
+def _command(update: Update) -> Optional[str]:
+    message = update.effective_message
+    if not message or not message.text or not message.text.startswith("/"):
+        return None
+    return message.text.split(maxsplit=1)[0].split("@", 1)[0].lower()
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates from different users concurrently, but each user's in order.
+
+    A file sent right after ``/compress_pdf`` must see the action state the
+    command set, so a user's updates wait for that user's previous one.
+    ``/cancel`` skips the line so it can stop a running AI call or job.
+    """
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self._locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        if not isinstance(update, Update) or update.effective_user is None or _command(update) in UNORDERED_COMMANDS:
+            await coroutine
+            return
+        user_id = update.effective_user.id
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        async with lock:
+            await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -1,7 +1,9 @@
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 
+from ai.openrouter_client import close_http_client, open_http_client
 from config import TELEGRAM_BOT_TOKEN, ensure_runtime_dirs, setup_logging
 from handlers import (
+    PerUserUpdateProcessor,
     cancel_command,
     compress_image_command,
     compress_pdf_command,
@@ -13,13 +15,36 @@ from handlers import (
     to_images_command,
     to_pdf_command,
 )
+from process_pool import file_pool
+from services.file_jobs import file_job_queue
+from session_manager import SessionManager
+
+
+async def _post_init(app: Application) -> None:
+    await open_http_client()
+    file_pool.start()
+    await file_job_queue.start(app.bot)
+
+
+async def _post_shutdown(app: Application) -> None:
+    await file_job_queue.stop()
+    await close_http_client()
+    await SessionManager().aflush()
+    file_pool.shutdown()
 
 
 def build_application() -> Application:
     if not TELEGRAM_BOT_TOKEN:
         raise ValueError("TELEGRAM_BOT_TOKEN is not configured")
 
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor())
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("cancel", cancel_command))
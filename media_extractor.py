@@ -1,36 +1,147 @@
 import os
 import logging
 import asyncio
+import shutil
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 from urllib.parse import urlparse
 import uuid
 
 from telegram import Bot
 
+from config import IN_MEMORY_DOWNLOAD_BYTES, MAX_DOWNLOAD_BYTES
+from singleflight import SingleFlight
+
 logger = logging.getLogger(__name__)
 DEFAULT_DOWNLOAD_DIR = "Temp/Cache_Downloaded"
 
+_downloads = SingleFlight()
 
-async def extract_file(bot: Bot, file_id: str, download_dir: str = DEFAULT_DOWNLOAD_DIR) -> str | None:
+
+class FileTooLargeError(ValueError):
+    """The file is over ``MAX_DOWNLOAD_BYTES`` and was not downloaded."""
+
+
+@dataclass(frozen=True)
+class FetchedFile:
+    """A downloaded Telegram file, held either in memory or on disk.
+
+    ``name`` carries the file's suffix for type detection even when there is
+    no path. Only on-disk files need ``cleanup()``.
+    """
+
+    name: str
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+
+    @property
+    def source(self) -> bytes | str:
+        """The bytes, or the path when the file was spilled to disk."""
+        return self.data if self.data is not None else self.path
+
+    def cleanup(self) -> None:
+        _remove_quietly(self.path)
+
+
+def file_size_error(file_size: Optional[int]) -> Optional[str]:
+    """Return a user-facing message when ``file_size`` is over the download limit."""
+    if file_size is None or file_size <= MAX_DOWNLOAD_BYTES:
+        return None
+    return (
+        f"This file is too large ({file_size / (1024 * 1024):.1f} MB). "
+        f"The limit is {MAX_DOWNLOAD_BYTES // (1024 * 1024)} MB."
+    )
+
+
+def _remove_quietly(path: str | None) -> None:
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _release(fetched: Optional[FetchedFile]) -> None:
+    if fetched is not None:
+        fetched.cleanup()
+
+
+def _private_copy(shared_path: str, download_dir: str) -> str:
+    # Each caller deletes its file when done, so hand out a separate name.
+    suffix = Path(shared_path).suffix
+    stem = Path(shared_path).stem.rsplit("_", 1)[0]
+    private_path = os.path.join(download_dir, f"{stem}_{uuid.uuid4().hex[:8]}{suffix}")
+    try:
+        os.link(shared_path, private_path)
+    except OSError:
+        shutil.copyfile(shared_path, private_path)
+    return private_path
+
+
+async def _download(bot: Bot, file_id: str, download_dir: str, in_memory_max: int) -> FetchedFile | None:
     try:
         file = await bot.get_file(file_id)
-        os.makedirs(download_dir, exist_ok=True)
+        size_error = file_size_error(file.file_size)
+        if size_error:
+            raise FileTooLargeError(size_error)
         parsed_path = urlparse(file.file_path or "").path
         suffix = Path(parsed_path).suffix or ".bin"
         unique_name = f"{file_id}_{uuid.uuid4().hex[:8]}{suffix}"
-        full_download_path = os.path.join(download_dir, unique_name)
 
+        if file.file_size is not None and file.file_size <= in_memory_max:
+            data = await asyncio.wait_for(file.download_as_bytearray(), timeout=60)
+            logger.info("Downloaded %s into memory (%d KB)", unique_name, len(data) // 1024)
+            return FetchedFile(name=unique_name, data=bytes(data))
+
+        os.makedirs(download_dir, exist_ok=True)
+        full_download_path = os.path.join(download_dir, unique_name)
         await asyncio.wait_for(
             file.download_to_drive(custom_path=full_download_path),
             timeout=60
         )
 
         logger.info("Downloaded file to: %s", full_download_path)
-        return full_download_path
+        return FetchedFile(name=unique_name, path=full_download_path)
 
+    except FileTooLargeError:
+        raise
     except asyncio.TimeoutError:
         logger.error("Download timeout for file_id: %s", file_id)
         return None
     except Exception as e:
         logger.error("Download failed for file_id %s: %s", file_id, e)
         return None
+
+
+async def fetch_file(
+    bot: Bot,
+    file_id: str,
+    download_dir: str = DEFAULT_DOWNLOAD_DIR,
+    in_memory_max: int = IN_MEMORY_DOWNLOAD_BYTES,
+) -> FetchedFile | None:
+    """Download ``file_id``, into memory when it is at most ``in_memory_max`` bytes.
+
+    Larger files are written to ``download_dir``; the caller owns that copy
+    and must ``cleanup()`` it. Files over ``MAX_DOWNLOAD_BYTES`` raise
+    ``FileTooLargeError`` before any content is transferred. Concurrent
+    requests for the same file share one download.
+    """
+    async with _downloads.shared(
+        (file_id, download_dir, in_memory_max),
+        lambda: _download(bot, file_id, download_dir, in_memory_max),
+        release=_release,
+    ) as shared:
+        if shared is None or shared.path is None:
+            return shared
+        try:
+            return FetchedFile(name=shared.name, path=_private_copy(shared.path, download_dir))
+        except OSError as e:
+            logger.error("Could not prepare downloaded file %s: %s", shared.path, e)
+            return None
+
+
+async def extract_file(bot: Bot, file_id: str, download_dir: str = DEFAULT_DOWNLOAD_DIR) -> str | None:
+    """Download ``file_id`` to disk and return a path the caller owns (and must delete)."""
+    fetched = await fetch_file(bot, file_id, download_dir, in_memory_max=0)
+    return fetched.path if fetched else None
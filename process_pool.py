@@ -0,0 +1,223 @@
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = os.cpu_count() or 2
+# Default limit; callers pass a per-action ``timeout`` for work that scales with input size.
+JOB_TIMEOUT_SECONDS = 120
+MAX_JOBS_PER_WORKER = 50
+# Imported once per worker so the first job does not pay for fitz/PIL/pypdf.
+PRELOAD_MODULES = (
+    "FileActions.img_compress",
+    "FileActions.img_pdf",
+    "FileActions.pdf_compress",
+)
+
+
+class JobTimeoutError(TimeoutError):
+    """The job overran its time limit; its worker process was killed."""
+
+
+class WorkerCrashedError(RuntimeError):
+    """The worker process died while running the job."""
+
+
+def _mp_context():
+    # Workers fork from a small server process that already holds the preloaded
+    # modules; fall back to spawn where forkserver is unavailable.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(list(PRELOAD_MODULES))
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+def _worker_main(conn, preload: tuple[str, ...], max_jobs: int) -> None:
+    # Ctrl+C is handled by the bot process, which then shuts the pool down.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from config import setup_logging
+
+    setup_logging()
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except ImportError as exc:
+            logger.warning("Worker could not preload %s: %s", name, exc)
+
+    for _ in range(max_jobs):
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        fn, args, kwargs, wants_progress = job
+        if wants_progress:
+            kwargs = {**kwargs, "progress": lambda *report: conn.send(("progress", *report))}
+        try:
+            result = ("result", True, fn(*args, **kwargs))
+        except Exception as exc:
+            result = ("result", False, exc)
+        try:
+            conn.send(result)
+        except Exception:
+            # The exception (or result) did not pickle; send something that does.
+            conn.send(("result", False, RuntimeError(repr(result[2]))))
+
+
+class _Worker:
+    def __init__(self, ctx, preload: tuple[str, ...], max_jobs: int):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child_conn, preload, max_jobs), daemon=True, name="file-worker"
+        )
+        self.process.start()
+        child_conn.close()
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        self.usable = True
+
+    def call(
+        self,
+        job: tuple,
+        timeout: float,
+        on_progress: Optional[Callable[..., None]] = None,
+    ) -> tuple[bool, Any]:
+        """Blocking: run ``job`` in the worker and return ``(ok, result_or_exception)``."""
+        self.conn.send(job)
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.conn.poll(remaining):
+                self.kill()
+                raise JobTimeoutError(f"File operation took longer than {timeout:.0f}s and was stopped.")
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                self.kill()
+                raise WorkerCrashedError("File worker stopped unexpectedly.") from None
+            if message[0] == "progress":
+                if on_progress is not None:
+                    on_progress(*message[1:])
+                continue
+            break
+        self.jobs += 1
+        if self.jobs >= self.max_jobs:
+            # The worker exits by itself after its last job.
+            self.usable = False
+        return message[1], message[2]
+
+    def kill(self) -> None:
+        self.usable = False
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class ProcessPool:
+    """Bounded pool of warm worker processes for CPU-bound file work.
+
+    Each job gets a whole worker, so a job that overruns its timeout (or is
+    cancelled) is stopped by killing that worker, and a fresh one takes its
+    place. Workers are also recycled after ``max_jobs_per_worker`` jobs to
+    cap leaks in native libraries.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = MAX_WORKERS,
+        job_timeout: float = JOB_TIMEOUT_SECONDS,
+        max_jobs_per_worker: int = MAX_JOBS_PER_WORKER,
+        preload: tuple[str, ...] = PRELOAD_MODULES,
+    ):
+        self.max_workers = max_workers
+        self.job_timeout = job_timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.preload = preload
+        self._ctx = None
+        self._idle: Optional[asyncio.Queue[_Worker]] = None
+        self._workers: set[_Worker] = set()
+        # Threads that wait on worker pipes; kept apart from the default executor.
+        self._waiters = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="file-pool")
+
+    def _spawn(self) -> _Worker:
+        multiprocessing.active_children()  # reap exited workers
+        worker = _Worker(self._ctx, self.preload, self.max_jobs_per_worker)
+        self._workers.add(worker)
+        return worker
+
+    def _retire(self, worker: _Worker) -> _Worker:
+        self._workers.discard(worker)
+        return self._spawn()
+
+    def start(self) -> None:
+        if self._idle is not None:
+            return
+        self._ctx = _mp_context()
+        self._idle = asyncio.Queue()
+        for _ in range(self.max_workers):
+            self._idle.put_nowait(self._spawn())
+        logger.info("Started %d file worker processes", self.max_workers)
+
+    @property
+    def busy(self) -> int:
+        return len(self._workers) - (self._idle.qsize() if self._idle else 0)
+
+    async def run(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        timeout: Optional[float] = None,
+        progress: Optional[Callable[..., None]] = None,
+        **kwargs,
+    ) -> Any:
+        """Run ``fn(*args, **kwargs)`` in a worker process and return its result.
+
+        ``fn`` and its arguments must be picklable (module-level functions).
+        Waits for a free worker when all are busy. With ``progress``, ``fn``
+        is passed a ``progress(done, total[, unit])`` callable whose reports
+        are delivered to ``progress`` on the event loop.
+        """
+        self.start()
+        worker = await self._idle.get()
+        loop = asyncio.get_running_loop()
+        limit = self.job_timeout if timeout is None else timeout
+        on_progress = None if progress is None else partial(loop.call_soon_threadsafe, progress)
+        job = (fn, args, kwargs, progress is not None)
+        try:
+            ok, value = await loop.run_in_executor(self._waiters, worker.call, job, limit, on_progress)
+        except BaseException:
+            # Timed out, crashed, or the caller was cancelled: stop the work for real.
+            worker.kill()
+            raise
+        finally:
+            self._idle.put_nowait(worker if worker.usable else self._retire(worker))
+        if not ok:
+            raise value
+        return value
+
+    def shutdown(self) -> None:
+        if self._idle is None:
+            return
+        for worker in list(self._workers):
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        for worker in list(self._workers):
+            worker.process.join(timeout=1)
+            worker.kill()
+        self._workers.clear()
+        self._idle = None
+        self._waiters.shutdown(wait=False)
+
+
+file_pool = ProcessPool()
@@ -0,0 +1,135 @@
+import math
+from typing import Iterable, Sequence
+
+# Per-user limiter state: a short, fixed-size tuple of floats (no per-request history).
+RateState = tuple[float, ...]
+
+
+class RateLimiter:
+    """``limit`` events per ``window`` seconds with constant memory per user.
+
+    Limiters are stateless strategies; the caller keeps each user's
+    ``RateState`` (e.g. on the session) and passes it in with the current
+    time. ``used`` is how many events currently count against the limit.
+    """
+
+    state_size = 0
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = float(window)
+
+    def initial_state(self) -> RateState:
+        raise NotImplementedError
+
+    def used(self, state: RateState, now: float) -> int:
+        raise NotImplementedError
+
+    def retry_after(self, state: RateState, now: float) -> float:
+        """Seconds until one more event fits (0 if it fits now)."""
+        raise NotImplementedError
+
+    def consume(self, state: RateState, now: float) -> RateState:
+        raise NotImplementedError
+
+    def refund(self, state: RateState, now: float) -> RateState:
+        """Give back one event counted by ``consume`` (e.g. the work was refused later)."""
+        raise NotImplementedError
+
+    def remaining(self, state: RateState, now: float) -> int:
+        return max(0, self.limit - self.used(state, now))
+
+    def load_state(self, values: Sequence[float]) -> RateState:
+        """Validate a stored state; anything malformed (or from another algorithm) resets."""
+        if len(values) != self.state_size:
+            return self.initial_state()
+        try:
+            return tuple(float(value) for value in values)
+        except (TypeError, ValueError):
+            return self.initial_state()
+
+    def from_timestamps(self, timestamps: Iterable[float]) -> RateState:
+        """Replay legacy per-request timestamps into this limiter's state."""
+        state = self.initial_state()
+        for ts in sorted(timestamps):
+            state = self.consume(state, ts)
+        return state
+
+
+class GCRA(RateLimiter):
+    """Generic cell rate algorithm; the state is the theoretical arrival time.
+
+    Events are spaced ``window / limit`` seconds apart with a burst tolerance
+    of ``limit`` events, so a full burst frees up one slot per interval
+    instead of all at once when the window ends.
+    """
+
+    state_size = 1
+
+    def __init__(self, limit: int, window: float):
+        super().__init__(limit, window)
+        self.interval = self.window / limit
+
+    def initial_state(self) -> RateState:
+        return (0.0,)
+
+    def used(self, state: RateState, now: float) -> int:
+        backlog = state[0] - now
+        if backlog <= 0:
+            return 0
+        return min(self.limit, math.ceil(backlog / self.interval - 1e-9))
+
+    def retry_after(self, state: RateState, now: float) -> float:
+        return max(0.0, state[0] - now - (self.window - self.interval))
+
+    def consume(self, state: RateState, now: float) -> RateState:
+        return (max(state[0], now) + self.interval,)
+
+    def refund(self, state: RateState, now: float) -> RateState:
+        return (max(now, state[0] - self.interval),)
+
+
+class TokenBucket(RateLimiter):
+    """Bucket of ``limit`` tokens refilled continuously at ``limit / window`` per second.
+
+    The state is ``(tokens, refilled_at)``.
+    """
+
+    state_size = 2
+
+    def __init__(self, limit: int, window: float):
+        super().__init__(limit, window)
+        self.rate = limit / self.window
+
+    def initial_state(self) -> RateState:
+        return (float(self.limit), 0.0)
+
+    def _tokens(self, state: RateState, now: float) -> float:
+        tokens, refilled_at = state
+        return min(float(self.limit), tokens + max(0.0, now - refilled_at) * self.rate)
+
+    def used(self, state: RateState, now: float) -> int:
+        return max(0, min(self.limit, math.ceil(self.limit - self._tokens(state, now) - 1e-9)))
+
+    def retry_after(self, state: RateState, now: float) -> float:
+        tokens = self._tokens(state, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def consume(self, state: RateState, now: float) -> RateState:
+        return (max(0.0, self._tokens(state, now) - 1), now)
+
+    def refund(self, state: RateState, now: float) -> RateState:
+        return (min(float(self.limit), self._tokens(state, now) + 1), now)
+
+
+ALGORITHMS: dict[str, type[RateLimiter]] = {
+    "gcra": GCRA,
+    "token_bucket": TokenBucket,
+}
+
+
+def make_limiter(algorithm: str, limit: int, window: float) -> RateLimiter:
+    try:
+        return ALGORITHMS[algorithm](limit, window)
+    except KeyError:
+        raise ValueError(f"Unknown rate limit algorithm: {algorithm!r}") from None
@@ -1,15 +1,25 @@
+from .file_jobs import JobQueueFullError, file_job_queue
 from .file_pipeline import (
     cleanup_paths,
     extract_file_id_for_action,
     process_action_file,
+    send_and_cache_output,
+    send_cached_result,
     send_output,
 )
-from .hbtu_service import format_hbtu_updates
+from .hbtu_service import fetch_hbtu_updates, format_hbtu_updates
+from .result_cache import file_result_cache
 
 __all__ = [
+    "JobQueueFullError",
     "cleanup_paths",
     "extract_file_id_for_action",
+    "file_job_queue",
+    "file_result_cache",
+    "fetch_hbtu_updates",
     "format_hbtu_updates",
     "process_action_file",
+    "send_and_cache_output",
+    "send_cached_result",
     "send_output",
 ]
@@ -0,0 +1,342 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional, TypeVar
+
+from telegram import Bot
+from telegram.error import BadRequest, TelegramError
+
+from config import OUTPUT_DIR
+from process_pool import file_pool
+from session_manager import ActionState
+
+from .file_pipeline import (
+    cleanup_paths,
+    process_action_file,
+    render_and_send_pages,
+    send_and_cache_output,
+    send_cached_result,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DB_PATH = "file_jobs.db"
+# More jobs than worker processes, so downloads and uploads overlap CPU work.
+MAX_RUNNING_JOBS = 2 * file_pool.max_workers
+MAX_RUNNING_PER_USER = 1
+MAX_QUEUED_PER_USER = 5
+MAX_QUEUED_TOTAL = 500
+PROGRESS_EDIT_INTERVAL_SECONDS = 3.0
+FINISHED_JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+
+class JobQueueFullError(RuntimeError):
+    """Raised instead of queueing when the queue (or the user's share of it) is full."""
+
+
+@dataclass
+class FileJob:
+    id: int
+    user_id: int
+    chat_id: int
+    action: ActionState
+    file_id: str
+    file_unique_id: str
+    status_message_id: Optional[int]
+    params: dict = field(default_factory=dict)
+
+
+class _StatusMessage:
+    """The Telegram message a job reports its state in, edited at a throttled rate."""
+
+    def __init__(self, bot: Bot, chat_id: int, message_id: Optional[int]):
+        self._bot = bot
+        self._chat_id = chat_id
+        self._message_id = message_id
+        self._text = ""
+        self._last_edit = 0.0
+        self._pending: Optional[asyncio.Task] = None
+
+    async def set(self, text: str, force: bool = False) -> None:
+        now = time.monotonic()
+        if text == self._text or (not force and now - self._last_edit < PROGRESS_EDIT_INTERVAL_SECONDS):
+            return
+        self._text = text
+        self._last_edit = now
+        try:
+            if self._message_id is None:
+                message = await self._bot.send_message(chat_id=self._chat_id, text=text)
+                self._message_id = message.message_id
+            else:
+                await self._bot.edit_message_text(text=text, chat_id=self._chat_id, message_id=self._message_id)
+        except BadRequest as exc:
+            # e.g. the user deleted the message; progress is best effort.
+            logger.debug("Status edit rejected: %s", exc)
+        except TelegramError as exc:
+            logger.warning("Status update failed: %s", exc)
+
+    def progress(self, text: str) -> bool:
+        """Schedule a throttled edit from sync code; return whether one was scheduled."""
+        if time.monotonic() - self._last_edit < PROGRESS_EDIT_INTERVAL_SECONDS:
+            return False
+        if self._pending is not None and not self._pending.done():
+            return False
+        self._pending = asyncio.ensure_future(self.set(text))
+        return True
+
+
+class FileJobQueue:
+    """Persistent queue of file actions, run through the file worker pool.
+
+    Jobs are stored in SQLite, so queued jobs (and jobs interrupted by a
+    restart) run after the bot starts again. At most ``MAX_RUNNING_JOBS``
+    run at once and at most ``MAX_RUNNING_PER_USER`` per user; the rest wait
+    in submission order. ``cancel_user`` drops queued jobs and stops running
+    ones, including the work inside the worker process.
+    """
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        # One thread owns the connection and keeps SQLite off the event loop.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-jobs-db")
+        self._bot: Optional[Bot] = None
+        self._dispatch_lock: Optional[asyncio.Lock] = None
+        self._running: dict[int, tuple[int, asyncio.Task]] = {}
+        self._cancelled: set[int] = set()
+
+    async def _db(self, fn: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS file_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    action TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    status_message_id INTEGER,
+                    progress TEXT NOT NULL DEFAULT '',
+                    error TEXT NOT NULL DEFAULT '',
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_file_jobs_status ON file_jobs (status, id)")
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(file_jobs)")}
+            if "file_unique_id" not in columns:
+                self._conn.execute("ALTER TABLE file_jobs ADD COLUMN file_unique_id TEXT NOT NULL DEFAULT ''")
+            if "params" not in columns:
+                self._conn.execute("ALTER TABLE file_jobs ADD COLUMN params TEXT NOT NULL DEFAULT '{}'")
+            self._conn.commit()
+        return self._conn
+
+    def _insert(self, user_id: int, chat_id: int, action: ActionState, file_id: str, file_unique_id: str,
+                status_message_id: Optional[int], params: dict) -> tuple[int, int]:
+        conn = self._connection()
+        queued_total = conn.execute("SELECT COUNT(*) FROM file_jobs WHERE status = 'queued'").fetchone()[0]
+        if queued_total >= MAX_QUEUED_TOTAL:
+            raise JobQueueFullError("The file queue is full. Please try again in a few minutes.")
+        user_jobs = conn.execute(
+            "SELECT COUNT(*) FROM file_jobs WHERE user_id = ? AND status IN ('queued', 'running')", (user_id,)
+        ).fetchone()[0]
+        if user_jobs >= MAX_QUEUED_PER_USER:
+            raise JobQueueFullError(
+                f"You already have {user_jobs} file jobs pending. Wait for them to finish or /cancel."
+            )
+        now = time.time()
+        with conn:
+            job_id = conn.execute(
+                """INSERT INTO file_jobs
+                   (user_id, chat_id, action, file_id, file_unique_id, status_message_id, params,
+                    created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (user_id, chat_id, action.value, file_id, file_unique_id, status_message_id, json.dumps(params),
+                 now, now),
+            ).lastrowid
+        return job_id, queued_total
+
+    def _requeue_interrupted(self) -> int:
+        conn = self._connection()
+        with conn:
+            conn.execute("UPDATE file_jobs SET status = 'queued' WHERE status = 'running'")
+            conn.execute(
+                "DELETE FROM file_jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated_at < ?",
+                (time.time() - FINISHED_JOB_RETENTION_SECONDS,),
+            )
+        return conn.execute("SELECT COUNT(*) FROM file_jobs WHERE status = 'queued'").fetchone()[0]
+
+    def _claim(self, busy_users: list[int], limit: int) -> list[FileJob]:
+        """Mark the oldest queued job of each non-busy user as running (oldest first)."""
+        conn = self._connection()
+        placeholders = ",".join("?" * len(busy_users))
+        exclude = f"AND user_id NOT IN ({placeholders})" if busy_users else ""
+        rows = conn.execute(
+            f"""SELECT id, user_id, chat_id, action, file_id, file_unique_id, status_message_id, params
+                FROM file_jobs
+                WHERE id IN (
+                    SELECT MIN(id) FROM file_jobs WHERE status = 'queued' {exclude} GROUP BY user_id
+                )
+                ORDER BY id LIMIT ?""",
+            (*busy_users, limit),
+        ).fetchall()
+        if rows:
+            with conn:
+                conn.executemany(
+                    "UPDATE file_jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                    [(time.time(), row[0]) for row in rows],
+                )
+        return [
+            FileJob(id=row[0], user_id=row[1], chat_id=row[2], action=ActionState(row[3]),
+                    file_id=row[4], file_unique_id=row[5], status_message_id=row[6], params=json.loads(row[7]))
+            for row in rows
+        ]
+
+    def _finish(self, job_id: int, status: str, error: str = "") -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE file_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+
+    def _set_progress(self, job_id: int, progress: str) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE file_jobs SET progress = ?, updated_at = ? WHERE id = ?", (progress, time.time(), job_id)
+            )
+
+    def _cancel_queued(self, user_id: int) -> int:
+        conn = self._connection()
+        with conn:
+            return conn.execute(
+                "UPDATE file_jobs SET status = 'cancelled', updated_at = ? WHERE user_id = ? AND status = 'queued'",
+                (time.time(), user_id),
+            ).rowcount
+
+    async def start(self, bot: Bot) -> None:
+        """Begin running jobs, resuming any left queued or running by the last process."""
+        self._bot = bot
+        self._dispatch_lock = asyncio.Lock()
+        pending = await self._db(self._requeue_interrupted)
+        if pending:
+            logger.info("Resuming %d queued file jobs", pending)
+        await self._dispatch()
+
+    async def stop(self) -> None:
+        """Stop running jobs without marking them finished, so the next start resumes them."""
+        tasks = [task for _, task in self._running.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._bot = None
+        self._executor.shutdown(wait=True)
+
+    async def enqueue(self, user_id: int, chat_id: int, action: ActionState, file_id: str,
+                      file_unique_id: str = "", status_message_id: Optional[int] = None,
+                      params: Optional[dict] = None) -> int:
+        """Queue a file action and return its id; raises ``JobQueueFullError``."""
+        job_id, queued = await self._db(
+            self._insert, user_id, chat_id, action, file_id, file_unique_id, status_message_id, params or {}
+        )
+        await self._dispatch()
+        if job_id not in self._running and queued and self._bot is not None:
+            # Users take turns, so this is the queue's length, not this job's place in it.
+            status = _StatusMessage(self._bot, chat_id, status_message_id)
+            await status.set(f"File received. Queued: {queued} other job(s) waiting.", force=True)
+        return job_id
+
+    async def cancel_user(self, user_id: int) -> int:
+        """Cancel the user's queued and running jobs; return how many."""
+        cancelled = await self._db(self._cancel_queued, user_id)
+        for job_id, (owner, task) in list(self._running.items()):
+            if owner == user_id:
+                self._cancelled.add(job_id)
+                task.cancel()
+                cancelled += 1
+        if cancelled:
+            logger.info("Cancelled %d file job(s) for user %s", cancelled, user_id)
+        return cancelled
+
+    async def _dispatch(self) -> None:
+        if self._bot is None:
+            return  # not started yet; start() picks the queued jobs up
+        async with self._dispatch_lock:
+            free = MAX_RUNNING_JOBS - len(self._running)
+            if free <= 0:
+                return
+            per_user = Counter(owner for owner, _ in self._running.values())
+            busy = [owner for owner, count in per_user.items() if count >= MAX_RUNNING_PER_USER]
+            for job in await self._db(self._claim, busy, free):
+                self._running[job.id] = (job.user_id, asyncio.create_task(self._run(job)))
+
+    async def _run(self, job: FileJob) -> None:
+        status = _StatusMessage(self._bot, job.chat_id, job.status_message_id)
+
+        def report(done: int, total: int, unit: str = "page") -> None:
+            text = f"Processing... {unit} {done}/{total}"
+            if status.progress(text):
+                self._executor.submit(self._set_progress, job.id, text)
+
+        input_path = None
+        output_path = None
+        outcome, error = "failed", ""
+        try:
+            # An identical job may have finished while this one was queued.
+            if await send_cached_result(self._bot, job.chat_id, job.file_unique_id, job.action, job.params):
+                await status.set("Done.", force=True)
+                outcome = "done"
+            elif job.action == ActionState.WAITING_FOR_PDF_TO_IMAGES:
+                await status.set("Processing...", force=True)
+                # Pages are sent as they are rendered, so there is no separate sending step.
+                input_path, output_path = await render_and_send_pages(
+                    self._bot, job.chat_id, job.file_id, job.file_unique_id, OUTPUT_DIR, job.params, progress=report
+                )
+                await status.set("Done.", force=True)
+                outcome = "done"
+            else:
+                await status.set("Processing...", force=True)
+                input_path, output_path = await process_action_file(
+                    self._bot, job.file_id, job.action, OUTPUT_DIR, progress=report, params=job.params
+                )
+                if not output_path:
+                    await status.set("Action failed or no changes were made.", force=True)
+                else:
+                    await status.set("Done. Sending your file(s)...", force=True)
+                    await send_and_cache_output(
+                        self._bot, job.chat_id, output_path, job.file_unique_id, job.action, job.params
+                    )
+                    outcome = "done"
+        except asyncio.CancelledError:
+            if job.id not in self._cancelled:
+                raise  # shutting down: stays 'running' and is resumed on the next start
+            outcome = "cancelled"
+            await status.set("Canceled.", force=True)
+        except Exception as exc:
+            logger.error("File job %d for user %s failed: %s", job.id, job.user_id, exc)
+            error = str(exc)
+            await status.set(f"An error occurred: {exc}", force=True)
+        finally:
+            cleanup_paths(input_path, output_path)
+            self._running.pop(job.id, None)
+            self._cancelled.discard(job.id)
+
+        await self._db(self._finish, job.id, outcome, error)
+        await self._dispatch()
+
+
+file_job_queue = FileJobQueue()
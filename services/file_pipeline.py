@@ -1,32 +1,82 @@
 import asyncio
+import datetime
+import logging
 import os
 import shutil
-from typing import Optional
+import tempfile
+import uuid
+import zipfile
+from contextlib import ExitStack
+from typing import Any, Callable, Optional
 
-from telegram import Bot, Message
+from telegram import Bot, InputMediaDocument, Message
+from telegram.error import BadRequest, RetryAfter
 
 from FileActions.img_compress import compress_image
-from FileActions.img_pdf import convert_image_to_pdf, convert_pdf_to_images
+from FileActions.img_pdf import (
+    DEFAULT_DPI,
+    DEFAULT_JPEG_QUALITY,
+    convert_image_to_pdf,
+    pdf_page_count,
+    render_pdf_pages,
+)
 from FileActions.pdf_compress import compress_pdf
-from media_extractor import extract_file
+from media_extractor import fetch_file, file_size_error
+from process_pool import JOB_TIMEOUT_SECONDS, file_pool
 from session_manager import ActionState
 
+from .result_cache import file_result_cache, make_result_key
+
+logger = logging.getLogger(__name__)
+
+# PDF to images renders and sends in batches through render_and_send_pages.
 ACTION_FUNCTIONS = {
     ActionState.WAITING_FOR_IMAGE_COMPRESS: compress_image,
     ActionState.WAITING_FOR_PDF_COMPRESS: compress_pdf,
     ActionState.WAITING_FOR_IMAGE_TO_PDF: convert_image_to_pdf,
-    ActionState.WAITING_FOR_PDF_TO_IMAGES: convert_pdf_to_images,
+}
+# Actions that accept a ``progress(done, total[, unit])`` callback; unit defaults to "page".
+PROGRESS_ACTIONS = {
+    ActionState.WAITING_FOR_PDF_COMPRESS,
+}
+
+# Seconds an action may run in a worker: a base plus an allowance per MB of
+# input, so a large scanned PDF is not cut off at the pool's default limit.
+ACTION_TIMEOUTS = {
+    ActionState.WAITING_FOR_IMAGE_COMPRESS: (JOB_TIMEOUT_SECONDS, 5),
+    ActionState.WAITING_FOR_PDF_COMPRESS: (JOB_TIMEOUT_SECONDS, 20),
+    ActionState.WAITING_FOR_IMAGE_TO_PDF: (JOB_TIMEOUT_SECONDS, 5),
+    ActionState.WAITING_FOR_PDF_TO_IMAGES: (JOB_TIMEOUT_SECONDS, 15),
 }
 
+# sendMediaGroup takes 2-10 items. Albums to one chat go out one at a time, in
+# order and spaced out, since Telegram posts each one when its upload ends and
+# throttles bursts to a single chat.
+MEDIA_GROUP_SIZE = 10
+ALBUM_INTERVAL_SECONDS = 1.0
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+# Worker processes one /to_images job may render page ranges on at once.
+PAGE_RENDER_PARALLELISM = max(1, file_pool.max_workers // 2)
+# Pool workers cannot start processes of their own, so /compress_pdf spreads its
+# images over threads in its worker, sized to the pool's idle capacity.
+PDF_IMAGE_WORKERS_MAX = 4
 
-def extract_file_id_for_action(message: Message, action_state: ActionState) -> tuple[Optional[str], Optional[str]]:
+
+def extract_file_id_for_action(
+    message: Message, action_state: ActionState
+) -> tuple[Optional[str], Optional[str], Optional[str]]:
+    """Return ``(file_id, file_unique_id, error)`` for the file the action needs."""
     if action_state in {
         ActionState.WAITING_FOR_IMAGE_COMPRESS,
         ActionState.WAITING_FOR_IMAGE_TO_PDF,
     }:
         if message.photo:
-            return message.photo[-1].file_id, None
-        return None, "Please send an image file.\nOr type /cancel to stop."
+            photo = message.photo[-1]
+            size_error = file_size_error(photo.file_size)
+            if size_error:
+                return None, None, size_error
+            return photo.file_id, photo.file_unique_id, None
+        return None, None, "Please send an image file.\nOr type /cancel to stop."
 
     if action_state in {
         ActionState.WAITING_FOR_PDF_COMPRESS,
@@ -34,32 +84,255 @@ def extract_file_id_for_action(message: Message, action_state: ActionState) -> t
     }:
         document = message.document
         if document and document.mime_type == "application/pdf":
-            return document.file_id, None
-        return None, "Please send a PDF document.\nOr type /cancel to stop."
+            size_error = file_size_error(document.file_size)
+            if size_error:
+                return None, None, size_error
+            return document.file_id, document.file_unique_id, None
+        return None, None, "Please send a PDF document.\nOr type /cancel to stop."
+
+    return None, None, "Unknown action state. Please try again."
+
 
-    return None, "Unknown action state. Please try again."
+def action_timeout(action_state: ActionState, size_bytes: int) -> float:
+    base, per_mb = ACTION_TIMEOUTS[action_state]
+    return base + per_mb * size_bytes / (1024 * 1024)
 
 
-async def process_action_file(bot: Bot, file_id: str, action_state: ActionState, output_dir: str) -> tuple[str, Optional[str]]:
-    input_path = await extract_file(bot, file_id)
-    if not input_path:
+async def process_action_file(
+    bot: Bot,
+    file_id: str,
+    action_state: ActionState,
+    output_dir: str,
+    progress: Optional[Callable[..., None]] = None,
+    params: Optional[dict[str, Any]] = None,
+) -> tuple[Optional[str], Optional[str]]:
+    """Run the action on ``file_id``; return ``(input_path, output_path)`` for cleanup.
+
+    Small files are handed to the worker as bytes and never touch the disk,
+    in which case ``input_path`` is None. ``params`` are passed to the action
+    as keyword arguments.
+    """
+    fetched = await fetch_file(bot, file_id)
+    if not fetched:
         raise ValueError("File could not be downloaded.")
 
     action = ACTION_FUNCTIONS[action_state]
-    output_path = await asyncio.to_thread(action, input_path, output_dir)
-    return input_path, output_path
+    if action_state not in PROGRESS_ACTIONS:
+        progress = None
+    kwargs = dict(params or {})
+    if action_state == ActionState.WAITING_FOR_PDF_COMPRESS:
+        idle = file_pool.max_workers - file_pool.busy
+        kwargs["image_workers"] = max(1, min(PDF_IMAGE_WORKERS_MAX, idle))
+    size = len(fetched.data) if fetched.data is not None else os.path.getsize(fetched.path)
+    try:
+        output_path = await file_pool.run(
+            action,
+            fetched.source,
+            output_dir,
+            timeout=action_timeout(action_state, size),
+            progress=progress,
+            **kwargs,
+        )
+    except BaseException:
+        # Timed out or cancelled: the caller never learns the input path.
+        fetched.cleanup()
+        raise
+    return fetched.path, output_path
+
+
+async def _send_batch(bot: Bot, chat_id: int, documents: list[str], from_disk: bool) -> list[str]:
+    """Send up to ``MEDIA_GROUP_SIZE`` documents (paths or file_ids) as one album."""
+    while True:
+        try:
+            with ExitStack() as stack:
+                sources = [stack.enter_context(open(path, "rb")) for path in documents] if from_disk else documents
+                if len(sources) == 1:
+                    message = await bot.send_document(chat_id=chat_id, document=sources[0])
+                    return [message.document.file_id]
+                media = [InputMediaDocument(media=source) for source in sources]
+                messages = await bot.send_media_group(chat_id=chat_id, media=media)
+                return [message.document.file_id for message in messages]
+        except RetryAfter as exc:
+            delay = exc.retry_after
+            await asyncio.sleep(delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay))
+
+
+async def _send_documents(bot: Bot, chat_id: int, documents: list[str], from_disk: bool = True) -> list[str]:
+    """Send documents as albums, one after another in order; return their file_ids."""
+    file_ids: list[str] = []
+    for start in range(0, len(documents), MEDIA_GROUP_SIZE):
+        if start:
+            await asyncio.sleep(ALBUM_INTERVAL_SECONDS)
+        file_ids += await _send_batch(bot, chat_id, documents[start : start + MEDIA_GROUP_SIZE], from_disk)
+    return file_ids
+
+
+def _zip_files(paths: list[str]) -> str:
+    # Page images are already compressed; storing them keeps zipping I/O-bound.
+    fd, zip_path = tempfile.mkstemp(suffix=".zip", dir=os.path.dirname(paths[0]))
+    with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_STORED) as archive:
+        for path in paths:
+            archive.write(path, arcname=os.path.basename(path))
+    return zip_path
+
+
+async def _deliver(bot: Bot, chat_id: int, paths: list[str], as_zip: bool = False) -> list[str]:
+    if not as_zip or len(paths) < 2:
+        return await _send_documents(bot, chat_id, paths)
 
+    zip_path = await asyncio.to_thread(_zip_files, paths)
+    try:
+        if os.path.getsize(zip_path) > MAX_UPLOAD_BYTES:
+            logger.info("ZIP of %d files is over the upload limit, sending albums", len(paths))
+            return await _send_documents(bot, chat_id, paths)
+        with open(zip_path, "rb") as f:
+            message = await bot.send_document(chat_id=chat_id, document=f, filename="result.zip")
+        return [message.document.file_id]
+    finally:
+        cleanup_paths(zip_path, None)
+
+
+async def send_output(bot: Bot, chat_id: int, output_path: str, as_zip: bool = False) -> list[str]:
+    """Upload the output file(s); return the Telegram file_ids they were given.
 
-async def send_output(bot: Bot, chat_id: int, output_path: str) -> None:
+    Several files are sent as albums of up to ``MEDIA_GROUP_SIZE``, or as a
+    single ZIP when ``as_zip`` is set and the archive fits the upload limit.
+    """
     if os.path.isdir(output_path):
-        for filename in sorted(os.listdir(output_path)):
-            filepath = os.path.join(output_path, filename)
-            with open(filepath, "rb") as f:
-                await bot.send_document(chat_id=chat_id, document=f)
+        paths = [os.path.join(output_path, filename) for filename in sorted(os.listdir(output_path))]
+    else:
+        paths = [output_path]
+    return await _deliver(bot, chat_id, paths, as_zip)
+
+
+async def send_cached_result(
+    bot: Bot, chat_id: int, file_unique_id: str, action_state: ActionState, params: Optional[dict[str, Any]] = None
+) -> bool:
+    """Answer from the result cache if this file was processed before; return whether it was."""
+    if not file_unique_id:
+        return False
+    key = make_result_key(file_unique_id, action_state.value, params)
+    cached = await asyncio.to_thread(file_result_cache.get, key)
+    if cached is None:
+        return False
+    if cached.file_ids:
+        try:
+            await _send_documents(bot, chat_id, cached.file_ids, from_disk=False)
+            return True
+        except BadRequest as exc:
+            logger.info("Cached file_id rejected, uploading again: %s", exc)
+    file_ids = await _deliver(bot, chat_id, cached.files, as_zip=bool((params or {}).get("zip")))
+    await asyncio.to_thread(file_result_cache.set_file_ids, key, file_ids)
+    return True
+
+
+async def _cache_result(
+    file_unique_id: Optional[str],
+    action_state: ActionState,
+    params: Optional[dict[str, Any]],
+    output_path: str,
+    file_ids: list[str],
+) -> None:
+    if not file_unique_id:
         return
+    key = make_result_key(file_unique_id, action_state.value, params)
+    if await asyncio.to_thread(file_result_cache.put, key, output_path) is not None:
+        await asyncio.to_thread(file_result_cache.set_file_ids, key, file_ids)
+
+
+async def send_and_cache_output(
+    bot: Bot,
+    chat_id: int,
+    output_path: str,
+    file_unique_id: Optional[str],
+    action_state: ActionState,
+    params: Optional[dict[str, Any]] = None,
+) -> None:
+    """Send the output and keep a copy (plus its file_ids) for repeat requests."""
+    file_ids = await send_output(bot, chat_id, output_path)
+    await _cache_result(file_unique_id, action_state, params, output_path, file_ids)
+
+
+async def render_and_send_pages(
+    bot: Bot,
+    chat_id: int,
+    file_id: str,
+    file_unique_id: Optional[str],
+    output_dir: str,
+    params: Optional[dict[str, Any]] = None,
+    progress: Optional[Callable[..., None]] = None,
+) -> tuple[Optional[str], str]:
+    """/to_images: render page ranges on several workers and send each album as it is ready.
+
+    ``params`` may hold ``pages`` (``[first, last]``), ``dpi``, ``quality`` and
+    ``zip``. Albums go out in page order while later ranges are still
+    rendering; with ``zip`` one archive is sent once every page is done. Returns
+    ``(input_path, output_path)`` for cleanup.
+    """
+    params = params or {}
+    fetched = await fetch_file(bot, file_id)
+    if not fetched:
+        raise ValueError("File could not be downloaded.")
+    output_subdir = os.path.join(
+        output_dir, f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}_images"
+    )
+    tasks: list[asyncio.Future] = []
+    try:
+        os.makedirs(output_subdir, exist_ok=True)
+        page_count = await asyncio.to_thread(pdf_page_count, fetched.source)
+        first_page, last_page = params.get("pages") or (1, page_count)
+        last_page = min(last_page, page_count)
+        if first_page > last_page:
+            raise ValueError(f"This PDF has {page_count} page(s).")
+
+        total = last_page - first_page + 1
+        ranges = [
+            (start, min(start + MEDIA_GROUP_SIZE - 1, last_page))
+            for start in range(first_page, last_page + 1, MEDIA_GROUP_SIZE)
+        ]
+        rendered = [0] * len(ranges)
+        size = len(fetched.data) if fetched.data is not None else os.path.getsize(fetched.path)
+        timeout = action_timeout(ActionState.WAITING_FOR_PDF_TO_IMAGES, size)
+        semaphore = asyncio.Semaphore(PAGE_RENDER_PARALLELISM)
+
+        async def render(index: int, start: int, end: int) -> list[str]:
+            def report(done: int, _range_total: int) -> None:
+                rendered[index] = done
+                if progress:
+                    progress(sum(rendered), total)
+
+            async with semaphore:
+                return await file_pool.run(
+                    render_pdf_pages,
+                    fetched.source,
+                    output_subdir,
+                    start,
+                    end,
+                    dpi=params.get("dpi", DEFAULT_DPI),
+                    quality=params.get("quality", DEFAULT_JPEG_QUALITY),
+                    timeout=timeout,
+                    progress=report,
+                )
+
+        tasks = [asyncio.ensure_future(render(index, start, end)) for index, (start, end) in enumerate(ranges)]
+        if params.get("zip"):
+            await asyncio.gather(*tasks)
+            file_ids = await send_output(bot, chat_id, output_subdir, as_zip=True)
+        else:
+            file_ids = []
+            for task in tasks:
+                file_ids += await _send_documents(bot, chat_id, await task)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        # Let the cancelled renders finish before their output directory goes,
+        # and retrieve their exceptions so none is reported as unhandled.
+        await asyncio.gather(*tasks, return_exceptions=True)
+        cleanup_paths(fetched.path, output_subdir)
+        raise
 
-    with open(output_path, "rb") as f:
-        await bot.send_document(chat_id=chat_id, document=f)
+    await _cache_result(file_unique_id, ActionState.WAITING_FOR_PDF_TO_IMAGES, params, output_subdir, file_ids)
+    return fetched.path, output_subdir
 
 
 def cleanup_paths(input_path: Optional[str], output_path: Optional[str]) -> None:
@@ -1,6 +1,9 @@
-from typing import Any
+import asyncio
+from typing import Any, Optional
 
-from ai.openrouter_client import generate_response
+from ai.openrouter_client import generate_response_async
+from hbtu_updates.cheking_update import check_for_updates
+from singleflight import SingleFlight
 
 SYSTEM_PROMPT = (
     "You format HBTU updates for Telegram in plain text. Keep the message concise and scannable. "
@@ -8,6 +11,9 @@ SYSTEM_PROMPT = (
 )
 
 
+_hbtu_flights = SingleFlight()
+
+
 def _fallback_format(updates: list[dict[str, Any]]) -> str:
     lines: list[str] = []
     for item in updates:
@@ -18,7 +24,12 @@ def _fallback_format(updates: list[dict[str, Any]]) -> str:
     return "\n\n".join(lines) if lines else "No updates found."
 
 
-def format_hbtu_updates(updates: list[dict[str, Any]], api_key: str, model_name: str) -> str:
+async def format_hbtu_updates(
+    updates: list[dict[str, Any]],
+    api_key: str,
+    model_name: str,
+    fallback_models: Optional[list[str]] = None,
+) -> str:
     if not updates:
         return "No new updates found on the HBTU website."
     if not api_key:
@@ -26,11 +37,21 @@ def format_hbtu_updates(updates: list[dict[str, Any]], api_key: str, model_name:
 
     prompt = f"Format this update list for Telegram:\n{updates}"
     try:
-        return generate_response(
-            api_key=api_key,
-            model_name=model_name,
-            prompt=prompt,
-            system_instruction=SYSTEM_PROMPT,
+        return await _hbtu_flights.do(
+            ("format", model_name, prompt),
+            lambda: generate_response_async(
+                api_key=api_key,
+                model_name=model_name,
+                prompt=prompt,
+                system_instruction=SYSTEM_PROMPT,
+                use_cache=True,
+                fallback_models=fallback_models,
+            ),
         )
     except Exception:
         return _fallback_format(updates)
+
+
+async def fetch_hbtu_updates() -> list[dict[str, Any]]:
+    """Scrape HBTU pages once for all users asking at the same moment."""
+    return await _hbtu_flights.do("check", lambda: asyncio.to_thread(check_for_updates))
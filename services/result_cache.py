@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "Temp/file_results.db"
+CACHE_DIR = "Temp/file_results"
+MAX_BYTES = 512 * 1024 * 1024
+
+
+def make_result_key(file_unique_id: str, action: str, params: Optional[dict[str, Any]] = None) -> str:
+    material = json.dumps(
+        {"file": file_unique_id, "action": action, "params": params or {}},
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CachedResult:
+    key: str
+    files: list[str]
+    # Telegram file_ids the result was delivered as (one per file, or one ZIP); empty until sent.
+    file_ids: list[str] = field(default_factory=list)
+
+
+class FileResultCache:
+    """Size-bounded LRU cache of file-operation outputs on disk.
+
+    Entries are keyed by ``make_result_key`` (Telegram ``file_unique_id``,
+    action and parameters) and hold a copy of the output files plus the
+    ``file_id`` Telegram assigned when they were first sent, so a repeat can
+    be answered by re-sending that id without downloading, processing or
+    uploading anything.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, cache_dir: str = CACHE_DIR, max_bytes: int = MAX_BYTES):
+        self.db_path = db_path
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_connection(self) -> sqlite3.Connection:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                cache_key TEXT PRIMARY KEY,
+                files TEXT NOT NULL,
+                file_ids TEXT NOT NULL DEFAULT '[]',
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_used ON results (last_used)")
+        return conn
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        try:
+            with self._lock, self._get_connection() as conn:
+                row = conn.execute(
+                    "SELECT files, file_ids FROM results WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    files = json.loads(row[0])
+                    if all(os.path.exists(path) for path in files):
+                        conn.execute("UPDATE results SET last_used = ? WHERE cache_key = ?", (time.time(), key))
+                        self.hits += 1
+                        return CachedResult(key=key, files=files, file_ids=json.loads(row[1]))
+                    conn.execute("DELETE FROM results WHERE cache_key = ?", (key,))
+                self.misses += 1
+        except (sqlite3.Error, ValueError) as exc:
+            logger.warning("File result cache read failed: %s", exc)
+        return None
+
+    def put(self, key: str, output_path: str) -> Optional[CachedResult]:
+        """Copy ``output_path`` (a file or a directory of files) into the cache."""
+        entry_dir = self._entry_dir(key)
+        sources = (
+            [os.path.join(output_path, name) for name in sorted(os.listdir(output_path))]
+            if os.path.isdir(output_path)
+            else [output_path]
+        )
+        try:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.makedirs(entry_dir)
+            files = []
+            for source in sources:
+                target = os.path.join(entry_dir, os.path.basename(source))
+                shutil.copyfile(source, target)
+                files.append(target)
+            size = sum(os.path.getsize(path) for path in files)
+            if size > self.max_bytes:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                return None
+            with self._lock, self._get_connection() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO results (cache_key, files, file_ids, size, last_used)
+                    VALUES (?, ?, '[]', ?, ?)
+                    ON CONFLICT(cache_key) DO UPDATE SET
+                        files = excluded.files,
+                        file_ids = '[]',
+                        size = excluded.size,
+                        last_used = excluded.last_used
+                    """,
+                    (key, json.dumps(files), size, time.time()),
+                )
+                self._evict(conn)
+        except (OSError, sqlite3.Error) as exc:
+            logger.warning("File result cache write failed: %s", exc)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        return CachedResult(key=key, files=files)
+
+    def set_file_ids(self, key: str, file_ids: list[str]) -> None:
+        try:
+            with self._lock, self._get_connection() as conn:
+                conn.execute(
+                    "UPDATE results SET file_ids = ? WHERE cache_key = ?", (json.dumps(file_ids), key)
+                )
+        except sqlite3.Error as exc:
+            logger.warning("File result cache update failed: %s", exc)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in conn.execute("SELECT cache_key, size FROM results ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM results WHERE cache_key = ?", (key,))
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total -= size
+            evicted += 1
+        logger.info("Evicted %d file results from the cache", evicted)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+        try:
+            with self._get_connection() as conn:
+                entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        except sqlite3.Error:
+            entries, size = 0, 0
+        stats.update(entries=entries, bytes=size, max_bytes=self.max_bytes)
+        return stats
+
+
+file_result_cache = FileResultCache()
@@ -1,17 +1,68 @@
+import asyncio
+import atexit
+from collections import OrderedDict
 import sqlite3
 import threading
 import time
 import logging
+import math
 import json
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from dataclasses import dataclass, field
-from typing import Optional
+from contextlib import nullcontext
+from dataclasses import dataclass, field, replace
+from functools import partial
+from typing import Callable, Optional, TypeVar
+
+from ai.tokens import estimate_message_tokens, estimate_tokens, history_token_budget
+from config import OPENROUTER_FALLBACK_MODELS, OPENROUTER_MODEL, REDIS_URL, SESSION_BACKEND
+from rate_limit import RateState, make_limiter
 
 logger = logging.getLogger(__name__)
 
 DB_PATH = "user_sessions.db"
+# PRAGMA user_version of the current layout; 2 moved history into `messages`,
+# 3 replaced rate-limit timestamp lists with fixed-size limiter state.
+SCHEMA_VERSION = 3
 SESSION_TTL_HOURS = 24
-MAX_HISTORY_LENGTH = 10
+CLEANUP_INTERVAL_SECONDS = 300
+# Expired sessions are deleted this many at a time, releasing the writer lock
+# (and pausing briefly) between batches so handlers are not stalled.
+CLEANUP_BATCH_SIZE = 500
+CLEANUP_BATCH_PAUSE_SECONDS = 0.01
+# Write-behind: changed sessions are flushed in one transaction at most this
+# many seconds later (the durability window). 0 writes every change through.
+WRITE_BEHIND_SECONDS = 1.0
+WRITE_BEHIND_MAX_DIRTY = 500
+DB_READER_THREADS = 4
+# In-memory session cache bounds; least recently used sessions are evicted
+# (after their pending writes are flushed) and reloaded from SQLite on demand.
+SESSION_CACHE_MAX_ENTRIES = 5000
+SESSION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+SESSION_CACHE_BYTES_CHECK_EVERY = 256
+SESSION_BASE_BYTES = 600
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+T = TypeVar("T")
+MAX_HISTORY_LENGTH = 40
+SUMMARY_TOKEN_BUDGET = 500
+SUMMARY_LINE_CHARS = 160
+SUMMARY_PREFIX = "Summary of earlier conversation:\n"
+# Turns kept verbatim must fit, next to a full summary, in the prompt budget
+# of every configured model; otherwise the prompt builder would drop turns
+# that were never folded into the summary.
+HISTORY_TOKEN_BUDGET = (
+    min(history_token_budget(model) for model in [OPENROUTER_MODEL, *OPENROUTER_FALLBACK_MODELS])
+    - SUMMARY_TOKEN_BUDGET
+    - estimate_tokens(SUMMARY_PREFIX)
+    - 1
+)
 
 AI_WINDOW_SECONDS = 60
 AI_MAX_REQUESTS = 5
@@ -21,6 +72,37 @@ AI_COOLDOWN_HOURS = 2
 FILE_OP_WINDOW_SECONDS = 3600
 FILE_OP_MAX_REQUESTS = 100
 
+# "gcra" or "token_bucket"; both keep a couple of floats per user and limit.
+RATE_LIMIT_ALGORITHM = "gcra"
+AI_LIMITER = make_limiter(RATE_LIMIT_ALGORITHM, AI_MAX_REQUESTS, AI_WINDOW_SECONDS)
+FILE_OP_LIMITER = make_limiter(RATE_LIMIT_ALGORITHM, FILE_OP_MAX_REQUESTS, FILE_OP_WINDOW_SECONDS)
+
+
+def _cooldown_message(seconds: float) -> str:
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    return f"Rate limit exceeded. Cooldown active. Try again in {hours}h {minutes}m."
+
+
+def _ai_limit_message() -> str:
+    return f"Rate limit exceeded. You can make {AI_MAX_REQUESTS} AI requests per minute. Cooldown: {AI_COOLDOWN_HOURS} hours."
+
+
+def _ai_warning_message(remaining: int) -> str:
+    return f"⚠️ Warning: Approaching AI request limit. {remaining} requests remaining."
+
+
+def _file_op_limit_message(retry_after: float) -> str:
+    minutes = max(1, math.ceil(retry_after / 60))
+    return f"File operation rate limit exceeded. Try again in {minutes} minutes."
+
+
+def _json_load(data: str, default) -> any:
+    try:
+        return json.loads(data)
+    except (json.JSONDecodeError, TypeError):
+        return default
+
 
 class ActionState(Enum):
     NONE = "none"
@@ -30,105 +112,218 @@ class ActionState(Enum):
     WAITING_FOR_PDF_TO_IMAGES = "to_images"
 
 
-@dataclass
+@dataclass(slots=True)
 class UserSession:
     user_id: int
     action_state: ActionState = ActionState.NONE
+    # Command arguments for the pending action, e.g. {"pages": [1, 5], "dpi": 150}.
+    action_params: dict = field(default_factory=dict)
     history: list[dict] = field(default_factory=list)
-    ai_request_timestamps: list[float] = field(default_factory=list)
+    summary: str = ""
+    ai_rate_state: RateState = field(default_factory=AI_LIMITER.initial_state)
     ai_warning_sent: bool = False
     ai_cooldown_until: float = 0.0
-    file_op_timestamps: list[float] = field(default_factory=list)
+    file_op_rate_state: RateState = field(default_factory=FILE_OP_LIMITER.initial_state)
     created_at: float = field(default_factory=time.time)
     updated_at: float = field(default_factory=time.time)
+    # history holds messages [history_start_seq, next_seq) of the messages table.
+    history_start_seq: int = 0
+    next_seq: int = 0
+    pending_messages: list[tuple] = field(default_factory=list, repr=False)
+    # Session fields changed since the last successful save, for backends that write per field.
+    changed_fields: set[str] = field(default_factory=set, repr=False)
+    # updated_at as of the last successful save; 0.0 until this process writes it.
+    saved_at: float = field(default=0.0, repr=False)
+
+    def set_action(self, state: ActionState, params: Optional[dict] = None):
+        self.action_state = state
+        self.action_params = dict(params or {})
+        self.changed_fields.update(("action_state", "action_params"))
 
     def add_message(self, role: str, text: str):
         self.history.append({'role': role, 'parts': [text]})
-        if len(self.history) > MAX_HISTORY_LENGTH:
-            self.history = self.history[-MAX_HISTORY_LENGTH:]
-
-    def _clean_old_timestamps(self, timestamps: list[float], window_seconds: int) -> list[float]:
-        now = time.time()
-        cutoff = now - window_seconds
-        return [ts for ts in timestamps if ts > cutoff]
+        self.pending_messages.append((self.next_seq, role, text, time.time()))
+        self.next_seq += 1
+        self.changed_fields.update(("summary", "history_start_seq"))
+        history_tokens = sum(self._entry_tokens(entry) for entry in self.history)
+        while len(self.history) > 1 and (
+            len(self.history) > MAX_HISTORY_LENGTH or history_tokens > HISTORY_TOKEN_BUDGET
+        ):
+            oldest = self.history.pop(0)
+            self.history_start_seq += 1
+            history_tokens -= self._entry_tokens(oldest)
+            self._fold_into_summary(oldest)
+
+    def take_pending_messages(self) -> list[tuple]:
+        pending, self.pending_messages = self.pending_messages, []
+        return pending
+
+    def take_snapshot(self) -> "UserSession":
+        """Copy of the session for a backend write; takes the changed-field marks."""
+        snapshot = replace(self, history=list(self.history), pending_messages=[])
+        self.changed_fields = set()
+        return snapshot
+
+    @staticmethod
+    def _entry_text(entry: dict) -> str:
+        return "\n".join(part for part in entry.get('parts', []) if isinstance(part, str))
+
+    def _entry_tokens(self, entry: dict) -> int:
+        return estimate_message_tokens(self._entry_text(entry))
+
+    def _fold_into_summary(self, entry: dict):
+        text = " ".join(self._entry_text(entry).split())
+        if not text:
+            return
+        if len(text) > SUMMARY_LINE_CHARS:
+            text = text[:SUMMARY_LINE_CHARS].rstrip() + "…"
+        speaker = "Assistant" if entry.get('role') == 'model' else "User"
+        lines = [line for line in self.summary.split("\n") if line]
+        lines.append(f"{speaker}: {text}")
+        while len(lines) > 1 and estimate_message_tokens("\n".join(lines)) > SUMMARY_TOKEN_BUDGET:
+            lines.pop(0)
+        self.summary = "\n".join(lines)
+
+    def get_prompt_history(self) -> list[dict]:
+        if not self.summary:
+            return list(self.history)
+        summary_entry = {
+            'role': 'system',
+            'parts': [f"{SUMMARY_PREFIX}{self.summary}"],
+        }
+        return [summary_entry] + list(self.history)
+
+    def estimated_bytes(self) -> int:
+        history_chars = sum(len(part) for entry in self.history for part in entry.get('parts', ()))
+        return (
+            SESSION_BASE_BYTES
+            + history_chars
+            + len(self.summary)
+        )
 
     def get_ai_status(self) -> tuple[int, int, bool, float]:
         now = time.time()
         if self.ai_cooldown_until > now:
             return 0, AI_MAX_REQUESTS, False, self.ai_cooldown_until - now
 
-        self.ai_request_timestamps = self._clean_old_timestamps(self.ai_request_timestamps, AI_WINDOW_SECONDS)
-        remaining = AI_MAX_REQUESTS - len(self.ai_request_timestamps)
-        return max(0, remaining), AI_MAX_REQUESTS, self.ai_warning_sent, 0
+        remaining = AI_LIMITER.remaining(self.ai_rate_state, now)
+        return remaining, AI_MAX_REQUESTS, self.ai_warning_sent, 0
 
     def can_make_ai_request(self) -> tuple[bool, str]:
         now = time.time()
 
         if self.ai_cooldown_until > now:
-            cooldown_remaining = self.ai_cooldown_until - now
-            hours = int(cooldown_remaining // 3600)
-            minutes = int((cooldown_remaining % 3600) // 60)
-            return False, f"Rate limit exceeded. Cooldown active. Try again in {hours}h {minutes}m."
+            return False, _cooldown_message(self.ai_cooldown_until - now)
 
-        self.ai_request_timestamps = self._clean_old_timestamps(self.ai_request_timestamps, AI_WINDOW_SECONDS)
+        used = AI_LIMITER.used(self.ai_rate_state, now)
 
-        if len(self.ai_request_timestamps) >= AI_MAX_REQUESTS:
+        if used >= AI_MAX_REQUESTS:
             self.ai_cooldown_until = now + (AI_COOLDOWN_HOURS * 3600)
             self.ai_warning_sent = False
-            return False, f"Rate limit exceeded. You can make {AI_MAX_REQUESTS} AI requests per minute. Cooldown: {AI_COOLDOWN_HOURS} hours."
+            return False, _ai_limit_message()
 
-        if len(self.ai_request_timestamps) >= AI_WARNING_THRESHOLD and not self.ai_warning_sent:
-            remaining = AI_MAX_REQUESTS - len(self.ai_request_timestamps)
+        if used >= AI_WARNING_THRESHOLD and not self.ai_warning_sent:
             self.ai_warning_sent = True
-            return True, f"⚠️ Warning: Approaching AI request limit. {remaining} requests remaining."
+            return True, _ai_warning_message(AI_MAX_REQUESTS - used)
 
         return True, ""
 
     def record_ai_request(self):
-        now = time.time()
-        self.ai_request_timestamps.append(now)
+        self.ai_rate_state = AI_LIMITER.consume(self.ai_rate_state, time.time())
         self.ai_warning_sent = False
 
     def can_make_file_op(self) -> tuple[bool, str]:
-        self.file_op_timestamps = self._clean_old_timestamps(self.file_op_timestamps, FILE_OP_WINDOW_SECONDS)
+        now = time.time()
 
-        if len(self.file_op_timestamps) >= FILE_OP_MAX_REQUESTS:
-            remaining_time = (
-                FILE_OP_WINDOW_SECONDS - (time.time() - self.file_op_timestamps[0])
-                if self.file_op_timestamps
-                else FILE_OP_WINDOW_SECONDS
-            )
-            minutes = int(remaining_time // 60)
-            return False, f"File operation rate limit exceeded. Try again in {minutes} minutes."
+        if FILE_OP_LIMITER.used(self.file_op_rate_state, now) >= FILE_OP_MAX_REQUESTS:
+            return False, _file_op_limit_message(FILE_OP_LIMITER.retry_after(self.file_op_rate_state, now))
 
         return True, ""
 
     def record_file_op(self):
-        self.file_op_timestamps.append(time.time())
+        self.file_op_rate_state = FILE_OP_LIMITER.consume(self.file_op_rate_state, time.time())
 
+    def refund_file_op(self):
+        self.file_op_rate_state = FILE_OP_LIMITER.refund(self.file_op_rate_state, time.time())
 
-class SessionManager:
-    _instance: Optional['SessionManager'] = None
-    _lock = threading.Lock()
 
-    def __new__(cls):
-        if cls._instance is None:
-            with cls._lock:
-                if cls._instance is None:
-                    cls._instance = super().__new__(cls)
-                    cls._instance._init()
-        return cls._instance
+class SessionBackend:
+    """Where sessions and their rate-limit state are stored.
+
+    The default rate-limit operations work on the session object, which is
+    enough while one process owns the data. A ``shared`` backend is seen by
+    several worker processes. It overrides these operations with atomic
+    server-side versions, and the manager then skips its in-memory cache and
+    write-behind so every worker reads current state.
+    """
+
+    shared = False
+
+    def load(self, user_id: int) -> Optional[UserSession]:
+        raise NotImplementedError
 
-    def _init(self):
-        self._db_lock = threading.Lock()
-        self._sessions: dict[int, UserSession] = {}
+    def save(self, batch: list[tuple[UserSession, list[tuple]]]):
+        """Persist sessions and append their new messages; raise on failure."""
+        raise NotImplementedError
+
+    def delete_expired(self, cutoff: float) -> list[int]:
+        """Drop sessions not updated since ``cutoff``; return their user ids."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def acquire_ai_request(self, session: UserSession) -> tuple[bool, str]:
+        """Check the AI limit and, if allowed, count the request in one step."""
+        allowed, message = session.can_make_ai_request()
+        if allowed:
+            session.record_ai_request()
+        return allowed, message
+
+    def acquire_file_op(self, session: UserSession) -> tuple[bool, str]:
+        allowed, message = session.can_make_file_op()
+        if allowed:
+            session.record_file_op()
+        return allowed, message
+
+    def check_file_op(self, session: UserSession) -> tuple[bool, str]:
+        """Check the file-op limit without counting a request."""
+        return session.can_make_file_op()
+
+    def refund_file_op(self, session: UserSession):
+        """Return a file op counted by ``acquire_file_op`` whose work was refused."""
+        session.refund_file_op()
+
+    def get_ai_status(self, session: UserSession) -> tuple[int, int, bool, float]:
+        return session.get_ai_status()
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Sessions in a local SQLite file; one process per file."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or DB_PATH
+        self._lock = threading.Lock()
+        self._reader_local = threading.local()
         self._init_db()
-        self._cleanup_thread = threading.Thread(target=self._cleanup_loop, daemon=True)
-        self._cleanup_thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        # WAL lets each thread read through its own connection without the writer lock.
+        conn = getattr(self._reader_local, "conn", None)
+        if conn is None:
+            conn = self._reader_local.conn = self._connect()
+        return conn
 
     def _init_db(self):
-        with self._db_lock:
-            self._conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        with self._lock:
+            # The single writer connection; reads go through per-thread readers.
+            self._conn = self._connect()
             self._conn.execute("""
                 CREATE TABLE IF NOT EXISTS sessions (
                     user_id INTEGER PRIMARY KEY,
@@ -142,141 +337,569 @@ class SessionManager:
                     updated_at REAL NOT NULL
                 )
             """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    user_id INTEGER NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, seq)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)")
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+            if "summary" not in columns:
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN summary TEXT NOT NULL DEFAULT ''")
+            if "history_start_seq" not in columns:
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN history_start_seq INTEGER NOT NULL DEFAULT 0")
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN next_seq INTEGER NOT NULL DEFAULT 0")
+            if "ai_rate_state" not in columns:
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN ai_rate_state TEXT NOT NULL DEFAULT '[]'")
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN file_op_rate_state TEXT NOT NULL DEFAULT '[]'")
+            if "action_params" not in columns:
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN action_params TEXT NOT NULL DEFAULT '{}'")
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < 2:
+                self._migrate_history_to_messages()
+            if version < 3:
+                self._migrate_rate_limit_state()
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
             self._conn.commit()
 
+    def _migrate_history_to_messages(self):
+        """Move the legacy sessions.history JSON blobs into the messages table."""
+        rows = self._conn.execute(
+            "SELECT user_id, history, updated_at FROM sessions WHERE history != '[]'"
+        ).fetchall()
+        for user_id, history_json, updated_at in rows:
+            history = _json_load(history_json, [])
+            messages = [
+                (user_id, seq, entry.get('role', 'user'), UserSession._entry_text(entry), updated_at)
+                for seq, entry in enumerate(entry for entry in history if isinstance(entry, dict))
+            ]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (user_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                messages,
+            )
+            self._conn.execute(
+                "UPDATE sessions SET history = '[]', history_start_seq = 0, next_seq = ? WHERE user_id = ?",
+                (len(messages), user_id),
+            )
+        if rows:
+            logger.info("Migrated history of %d sessions to the messages table", len(rows))
+
+    def _migrate_rate_limit_state(self):
+        """Replay the legacy per-request timestamp lists into limiter state."""
+        rows = self._conn.execute(
+            "SELECT user_id, ai_timestamps, file_op_timestamps FROM sessions "
+            "WHERE ai_timestamps != '[]' OR file_op_timestamps != '[]'"
+        ).fetchall()
+        for user_id, ai_json, file_op_json in rows:
+            ai_state = AI_LIMITER.from_timestamps(_json_load(ai_json, []))
+            file_op_state = FILE_OP_LIMITER.from_timestamps(_json_load(file_op_json, []))
+            self._conn.execute(
+                """UPDATE sessions SET ai_rate_state = ?, file_op_rate_state = ?,
+                   ai_timestamps = '[]', file_op_timestamps = '[]' WHERE user_id = ?""",
+                (json.dumps(ai_state), json.dumps(file_op_state), user_id),
+            )
+        if rows:
+            logger.info("Migrated rate-limit state of %d sessions", len(rows))
+
+    def load(self, user_id: int) -> Optional[UserSession]:
+        reader = self._reader()
+        row = reader.execute(
+            """SELECT action_state, history_start_seq, ai_rate_state, ai_warning_sent,
+               ai_cooldown_until, file_op_rate_state, created_at, summary, next_seq, action_params
+               FROM sessions WHERE user_id = ?""",
+            (user_id,)
+        ).fetchone()
+        if not row:
+            return None
+        return UserSession(
+            user_id=user_id,
+            action_state=ActionState(row[0]),
+            action_params=_json_load(row[9], {}),
+            history=self._load_history_window(reader, user_id, row[1]),
+            summary=row[7] or "",
+            ai_rate_state=AI_LIMITER.load_state(_json_load(row[2], [])),
+            ai_warning_sent=bool(row[3]),
+            ai_cooldown_until=float(row[4]),
+            file_op_rate_state=FILE_OP_LIMITER.load_state(_json_load(row[5], [])),
+            created_at=row[6],
+            history_start_seq=row[1],
+            next_seq=row[8],
+        )
+
+    @staticmethod
+    def _load_history_window(conn: sqlite3.Connection, user_id: int, start_seq: int) -> list[dict]:
+        rows = conn.execute(
+            """SELECT role, content FROM messages
+               WHERE user_id = ? AND seq >= ?
+               ORDER BY seq DESC LIMIT ?""",
+            (user_id, start_seq, MAX_HISTORY_LENGTH),
+        ).fetchall()
+        return [{'role': role, 'parts': [content]} for role, content in reversed(rows)]
+
+    @staticmethod
+    def _session_row(session: UserSession) -> tuple:
+        return (
+            session.user_id,
+            session.action_state.value,
+            json.dumps(session.action_params),
+            session.summary,
+            session.history_start_seq,
+            session.next_seq,
+            json.dumps(session.ai_rate_state),
+            int(session.ai_warning_sent),
+            session.ai_cooldown_until,
+            json.dumps(session.file_op_rate_state),
+            session.created_at,
+            session.updated_at,
+        )
+
+    def save(self, batch: list[tuple[UserSession, list[tuple]]]):
+        """Upsert session rows and append their new messages in one transaction."""
+        session_rows = [self._session_row(session) for session, _ in batch]
+        message_rows = [
+            (session.user_id, seq, role, content, created_at)
+            for session, pending in batch
+            for seq, role, content, created_at in pending
+        ]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("""
+                    INSERT OR REPLACE INTO sessions
+                    (user_id, action_state, action_params, summary, history_start_seq, next_seq, ai_rate_state,
+                     ai_warning_sent, ai_cooldown_until, file_op_rate_state, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, session_rows)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO messages (user_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                    message_rows,
+                )
+                # Messages folded into the summary are never read again; this is
+                # a primary-key range delete, so it stays cheap per session.
+                self._conn.executemany(
+                    "DELETE FROM messages WHERE user_id = ? AND seq < ?",
+                    [(session.user_id, session.history_start_seq) for session, _ in batch if session.history_start_seq],
+                )
+
+    def delete_expired(self, cutoff: float) -> list[int]:
+        expired: list[int] = []
+        while True:
+            with self._lock:
+                # Served by idx_sessions_updated_at instead of a table scan.
+                user_ids = [row[0] for row in self._conn.execute(
+                    "SELECT user_id FROM sessions WHERE updated_at < ? LIMIT ?",
+                    (cutoff, CLEANUP_BATCH_SIZE),
+                )]
+                if not user_ids:
+                    break
+                placeholders = ",".join("?" * len(user_ids))
+                with self._conn:
+                    self._conn.execute(f"DELETE FROM messages WHERE user_id IN ({placeholders})", user_ids)
+                    self._conn.execute(f"DELETE FROM sessions WHERE user_id IN ({placeholders})", user_ids)
+            expired.extend(user_ids)
+            if len(user_ids) < CLEANUP_BATCH_SIZE:
+                break
+            time.sleep(CLEANUP_BATCH_PAUSE_SECONDS)
+        return expired
+
+    def close(self):
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+
+def make_backend(name: str = SESSION_BACKEND) -> SessionBackend:
+    if name == "sqlite":
+        return SQLiteSessionBackend()
+    if name == "redis":
+        from session_redis import RedisSessionBackend
+
+        return RedisSessionBackend(url=REDIS_URL)
+    raise ValueError(f"Unknown session backend: {name!r}")
+
+
+class SessionManager:
+    _instance: Optional['SessionManager'] = None
+    _lock = threading.Lock()
+
+    def __new__(cls, backend: Optional[SessionBackend] = None):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+                    cls._instance._init(backend or make_backend())
+        return cls._instance
+
+    def _init(self, backend: SessionBackend):
+        self._backend = backend
+        self._sessions: OrderedDict[int, UserSession] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_evictions = 0
+        self._loads_since_bytes_check = 0
+        self._cleanup_runs = 0
+        self._cleanup_removed = 0
+        self._cleanup_last_seconds = 0.0
+        self._cleanup_max_seconds = 0.0
+        self._dirty_lock = threading.Lock()
+        self._dirty: dict[int, UserSession] = {}
+        self._flush_event = threading.Event()
+        self._db_executor = ThreadPoolExecutor(max_workers=DB_READER_THREADS, thread_name_prefix="session-db")
+        self._cleanup_thread = threading.Thread(target=self._cleanup_loop, daemon=True)
+        self._cleanup_thread.start()
+        if self._write_behind:
+            self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flush_thread.start()
+        atexit.register(self.flush)
+
+    @property
+    def _write_behind(self) -> bool:
+        # Other workers read a shared backend directly, so changes must land at once.
+        return WRITE_BEHIND_SECONDS > 0 and not self._backend.shared
+
     def _cleanup_loop(self):
         while True:
-            time.sleep(300)
+            time.sleep(CLEANUP_INTERVAL_SECONDS)
             self._cleanup_expired()
 
+    def _flush_loop(self):
+        while True:
+            self._flush_event.wait(WRITE_BEHIND_SECONDS)
+            self._flush_event.clear()
+            self.flush()
+
     def _cleanup_expired(self):
+        started = time.monotonic()
+        cutoff = time.time() - (SESSION_TTL_HOURS * 3600)
+        # get_session only touches updated_at in memory; persist the touch of
+        # cached sessions whose stored row would otherwise look expired.
+        with self._cache_lock:
+            touched = [
+                session for session in self._sessions.values()
+                if session.saved_at < cutoff <= session.updated_at
+            ]
+        for session in touched:
+            self._save_session(session)
+        # Pending writes carry fresh updated_at values; land them before judging expiry.
+        self.flush()
         try:
-            with self._db_lock:
-                now = time.time()
-                cutoff = now - (SESSION_TTL_HOURS * 3600)
-                cur = self._conn.execute(
-                    "SELECT user_id FROM sessions WHERE updated_at < ?", (cutoff,)
-                )
-                expired = [row[0] for row in cur.fetchall()]
-                if expired:
-                    self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,))
-                    self._conn.commit()
-                    for uid in expired:
-                        self._sessions.pop(uid, None)
-                    logger.info("Cleaned up %d expired sessions", len(expired))
+            expired = self._backend.delete_expired(cutoff)
         except Exception as e:
             logger.error("Cleanup error: %s", e)
+            expired = []
+
+        # Drop the deleted sessions from the cache too, along with idle ones that
+        # never reached the backend; a session awaiting a write stays.
+        deleted = set(expired)
+        with self._cache_lock, self._dirty_lock:
+            stale = [
+                uid for uid, session in self._sessions.items()
+                if (uid in deleted or session.updated_at < cutoff) and uid not in self._dirty
+            ]
+            for uid in stale:
+                del self._sessions[uid]
+
+        elapsed = time.monotonic() - started
+        with self._cache_lock:
+            self._cleanup_runs += 1
+            self._cleanup_removed += len(expired)
+            self._cleanup_last_seconds = elapsed
+            self._cleanup_max_seconds = max(self._cleanup_max_seconds, elapsed)
+        if expired or stale:
+            logger.info(
+                "Cleaned up %d expired sessions (%d cached) in %.3fs", len(expired), len(stale), elapsed
+            )
 
-    def _json_load(self, data: str, default) -> any:
-        try:
-            return json.loads(data)
-        except (json.JSONDecodeError, TypeError):
-            return default
+    def cleanup_stats(self) -> dict:
+        with self._cache_lock:
+            return {
+                "runs": self._cleanup_runs,
+                "removed": self._cleanup_removed,
+                "last_seconds": self._cleanup_last_seconds,
+                "max_seconds": self._cleanup_max_seconds,
+            }
 
     def get_session(self, user_id: int) -> UserSession:
         now = time.time()
-        if user_id in self._sessions:
-            session = self._sessions[user_id]
+        with self._cache_lock:
+            session = self._sessions.get(user_id)
+            if session is not None:
+                self._sessions.move_to_end(user_id)
+                self._cache_hits += 1
+            else:
+                self._cache_misses += 1
+        if session is not None:
             session.updated_at = now
             return session
 
-        with self._db_lock:
-            cur = self._conn.execute(
-                """SELECT action_state, history, ai_timestamps, ai_warning_sent,
-                   ai_cooldown_until, file_op_timestamps, created_at
-                   FROM sessions WHERE user_id = ?""",
-                (user_id,)
-            )
-            row = cur.fetchone()
-
-        if row:
-            session = UserSession(
-                user_id=user_id,
-                action_state=ActionState(row[0]),
-                history=self._json_load(row[1], []),
-                ai_request_timestamps=self._json_load(row[2], []),
-                ai_warning_sent=bool(row[3]),
-                ai_cooldown_until=float(row[4]),
-                file_op_timestamps=self._json_load(row[5], []),
-                created_at=row[6],
-                updated_at=now
-            )
-        else:
-            session = UserSession(user_id=user_id)
+        session = self._backend.load(user_id) or UserSession(user_id=user_id)
+        session.updated_at = now
+        if self._backend.shared:
+            return session
 
-        self._sessions[user_id] = session
+        # Another thread may have loaded the same user meanwhile; keep the first.
+        with self._cache_lock:
+            session = self._sessions.setdefault(user_id, session)
+            self._loads_since_bytes_check += 1
+            check_bytes = self._loads_since_bytes_check >= SESSION_CACHE_BYTES_CHECK_EVERY
+            over_limit = len(self._sessions) > SESSION_CACHE_MAX_ENTRIES
+        if over_limit or check_bytes:
+            self._enforce_cache_bounds()
         return session
 
-    def _save_session(self, session: UserSession):
+    def _cache_bytes(self) -> int:
+        with self._cache_lock:
+            sessions = list(self._sessions.values())
+        return sum(session.estimated_bytes() for session in sessions)
+
+    def _enforce_cache_bounds(self):
+        """Evict least recently used sessions until both cache bounds hold."""
+        with self._cache_lock:
+            self._loads_since_bytes_check = 0
+        total_bytes = self._cache_bytes()
+        if len(self._sessions) <= SESSION_CACHE_MAX_ENTRIES and total_bytes <= SESSION_CACHE_MAX_BYTES:
+            return
+
+        # Evicted sessions are reloaded from the backend, so it must hold their latest state.
+        self.flush()
+        evicted = 0
+        with self._cache_lock:
+            candidates = len(self._sessions)
+            while candidates > 0 and len(self._sessions) > 1 and (
+                len(self._sessions) > SESSION_CACHE_MAX_ENTRIES or total_bytes > SESSION_CACHE_MAX_BYTES
+            ):
+                candidates -= 1
+                user_id, session = self._sessions.popitem(last=False)
+                with self._dirty_lock:
+                    dirty = user_id in self._dirty
+                if dirty:
+                    # Changed again since the flush; keep it until it is written.
+                    self._sessions[user_id] = session
+                    continue
+                total_bytes -= session.estimated_bytes()
+                evicted += 1
+            self._cache_evictions += evicted
+        if evicted:
+            logger.info("Evicted %d sessions from the in-memory cache", evicted)
+
+    def cache_stats(self) -> dict:
+        with self._cache_lock:
+            lookups = self._cache_hits + self._cache_misses
+            stats = {
+                "entries": len(self._sessions),
+                "max_entries": SESSION_CACHE_MAX_ENTRIES,
+                "hits": self._cache_hits,
+                "misses": self._cache_misses,
+                "hit_rate": (self._cache_hits / lookups) if lookups else 0.0,
+                "evictions": self._cache_evictions,
+            }
+        stats["approx_bytes"] = self._cache_bytes()
+        return stats
+
+    def _take_batch(self, sessions: list[UserSession]) -> list[tuple[UserSession, list[tuple]]]:
+        """Snapshot sessions and their new messages; the caller holds ``_dirty_lock``.
+
+        The backend serialises the snapshots, so inline session changes on
+        the event loop can continue while the write runs.
+        """
+        return [(session.take_snapshot(), session.take_pending_messages()) for session in sessions]
+
+    def _write_sessions(self, sessions: list[UserSession], batch: list[tuple[UserSession, list[tuple]]]) -> bool:
         try:
-            with self._db_lock:
-                self._conn.execute("""
-                    INSERT OR REPLACE INTO sessions
-                    (user_id, action_state, history, ai_timestamps, ai_warning_sent,
-                     ai_cooldown_until, file_op_timestamps, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    session.user_id,
-                    session.action_state.value,
-                    json.dumps(session.history),
-                    json.dumps(session.ai_request_timestamps),
-                    int(session.ai_warning_sent),
-                    session.ai_cooldown_until,
-                    json.dumps(session.file_op_timestamps),
-                    session.created_at,
-                    session.updated_at
-                ))
-                self._conn.commit()
+            self._backend.save(batch)
         except Exception as e:
-            logger.error("Failed to save session: %s", e)
+            logger.error("Failed to save %d session(s): %s", len(batch), e)
+            # Hand the taken marks and messages back for the next attempt.
+            with self._dirty_lock:
+                for session, (snapshot, pending) in zip(sessions, batch):
+                    session.changed_fields |= snapshot.changed_fields
+                    session.pending_messages[:0] = pending
+            return False
+        for session, (snapshot, _) in zip(sessions, batch):
+            session.saved_at = snapshot.updated_at
+        return True
 
-    def set_action(self, user_id: int, state: ActionState) -> UserSession:
+    def _save_session(self, session: UserSession):
+        if not self._write_behind:
+            with self._dirty_lock:
+                batch = self._take_batch([session])
+            self._write_sessions([session], batch)
+            return
+        with self._dirty_lock:
+            self._dirty[session.user_id] = session
+            backlog = len(self._dirty)
+        if backlog >= WRITE_BEHIND_MAX_DIRTY:
+            self._flush_event.set()
+
+    def flush(self) -> int:
+        """Write all pending session changes in one transaction; return how many."""
+        with self._dirty_lock:
+            sessions = list(self._dirty.values())
+            batch = self._take_batch(sessions)
+            self._dirty.clear()
+        if not batch:
+            return 0
+        if not self._write_sessions(sessions, batch):
+            with self._dirty_lock:
+                for session in sessions:
+                    self._dirty.setdefault(session.user_id, session)
+            return 0
+        return len(batch)
+
+    def set_action(self, user_id: int, state: ActionState, params: Optional[dict] = None) -> UserSession:
         session = self.get_session(user_id)
-        session.action_state = state
-        session.updated_at = time.time()
+        with self._dirty_lock:
+            session.set_action(state, params)
+            session.updated_at = time.time()
         self._save_session(session)
         return session
 
     def clear_action(self, user_id: int):
         session = self.get_session(user_id)
-        session.action_state = ActionState.NONE
-        session.updated_at = time.time()
+        with self._dirty_lock:
+            session.set_action(ActionState.NONE)
+            session.updated_at = time.time()
         self._save_session(session)
 
     def add_history(self, user_id: int, role: str, text: str):
         session = self.get_session(user_id)
-        session.add_message(role, text)
-        session.updated_at = time.time()
+        with self._dirty_lock:
+            session.add_message(role, text)
+            session.updated_at = time.time()
         self._save_session(session)
 
+    def acquire_ai_request(self, user_id: int) -> tuple[bool, str]:
+        """Check the AI rate limit and count the request if it is allowed.
+
+        Returns ``(allowed, message)``; ``message`` is a refusal or a warning
+        to show the user, or empty.
+        """
+        session = self.get_session(user_id)
+        with self._rate_lock():
+            result = self._backend.acquire_ai_request(session)
+        self._save_rate_state(session)
+        return result
+
+    def acquire_file_op(self, user_id: int) -> tuple[bool, str]:
+        session = self.get_session(user_id)
+        with self._rate_lock():
+            result = self._backend.acquire_file_op(session)
+        self._save_rate_state(session)
+        return result
+
+    def refund_file_op(self, user_id: int):
+        session = self.get_session(user_id)
+        with self._rate_lock():
+            self._backend.refund_file_op(session)
+        self._save_rate_state(session)
+
+    def _rate_lock(self):
+        # Local backends count on the cached session, which flush snapshots
+        # under _dirty_lock; a shared backend counts server-side, and holding
+        # the lock across that round trip would stall every other session.
+        return nullcontext() if self._backend.shared else self._dirty_lock
+
+    def _save_rate_state(self, session: UserSession):
+        # A shared backend has already stored the count server-side; saving the
+        # session loaded for the call could revert another worker's changes.
+        if not self._backend.shared:
+            self._save_session(session)
+
+    # Two-step forms of acquire_ai_request/acquire_file_op, kept for existing
+    # callers. The check and the record are separate calls, so two concurrent
+    # requests can both pass the check; new code should use acquire_*.
     def check_ai_rate_limit(self, user_id: int) -> tuple[bool, str]:
         session = self.get_session(user_id)
-        return session.can_make_ai_request()
+        if not self._backend.shared:
+            return session.can_make_ai_request()
+        remaining, _, _, cooldown = self._backend.get_ai_status(session)
+        if cooldown > 0:
+            return False, _cooldown_message(cooldown)
+        if remaining <= 0:
+            return False, _ai_limit_message()
+        return True, ""
 
     def record_ai_request(self, user_id: int):
         session = self.get_session(user_id)
-        session.record_ai_request()
+        if self._backend.shared:
+            self._backend.acquire_ai_request(session)
+            return
+        with self._dirty_lock:
+            session.record_ai_request()
         self._save_session(session)
 
     def check_file_op_rate_limit(self, user_id: int) -> tuple[bool, str]:
-        session = self.get_session(user_id)
-        return session.can_make_file_op()
+        return self._backend.check_file_op(self.get_session(user_id))
 
     def record_file_op(self, user_id: int):
         session = self.get_session(user_id)
-        session.record_file_op()
+        if self._backend.shared:
+            self._backend.acquire_file_op(session)
+            return
+        with self._dirty_lock:
+            session.record_file_op()
         self._save_session(session)
 
     def get_ai_quota(self, user_id: int) -> str:
         session = self.get_session(user_id)
-        remaining, total, _, cooldown = session.get_ai_status()
+        remaining, total, _, cooldown = self._backend.get_ai_status(session)
         if cooldown > 0:
             hours = int(cooldown // 3600)
             minutes = int((cooldown % 3600) // 60)
             return f"AI quota: On cooldown ({hours}h {minutes}m)"
         return f"AI quota: {remaining}/{total} remaining"
 
+    async def _run(self, user_id: int, fn: Callable[..., T], *args) -> T:
+        """Run a sync session operation without blocking the event loop on I/O.
+
+        Cached sessions under write-behind are pure memory work and run
+        inline; anything that may touch the backend goes to the DB threads.
+        """
+        with self._cache_lock:
+            cached = user_id in self._sessions
+            if cached:
+                # Most recently used, so a concurrent eviction passes it over.
+                self._sessions.move_to_end(user_id)
+        if cached and self._write_behind:
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, partial(fn, *args))
+
+    async def aget_session(self, user_id: int) -> UserSession:
+        return await self._run(user_id, self.get_session, user_id)
+
+    async def aset_action(self, user_id: int, state: ActionState, params: Optional[dict] = None) -> UserSession:
+        return await self._run(user_id, self.set_action, user_id, state, params)
+
+    async def aclear_action(self, user_id: int):
+        await self._run(user_id, self.clear_action, user_id)
+
+    async def aadd_history(self, user_id: int, role: str, text: str):
+        await self._run(user_id, self.add_history, user_id, role, text)
+
+    async def aacquire_ai_request(self, user_id: int) -> tuple[bool, str]:
+        return await self._run(user_id, self.acquire_ai_request, user_id)
+
+    async def aacquire_file_op(self, user_id: int) -> tuple[bool, str]:
+        return await self._run(user_id, self.acquire_file_op, user_id)
+
+    async def arefund_file_op(self, user_id: int):
+        await self._run(user_id, self.refund_file_op, user_id)
+
+    async def aget_ai_quota(self, user_id: int) -> str:
+        return await self._run(user_id, self.get_ai_quota, user_id)
+
+    async def aflush(self) -> int:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, self.flush)
+
     def close(self):
-        with self._db_lock:
-            if self._conn:
-                self._conn.close()
+        self.flush()
+        self._db_executor.shutdown(wait=False)
+        self._backend.close()
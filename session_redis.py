@@ -0,0 +1,272 @@
+import json
+import logging
+from typing import Any, Optional
+
+from rate_limit import GCRA
+from session_manager import (
+    AI_COOLDOWN_HOURS,
+    AI_MAX_REQUESTS,
+    AI_WARNING_THRESHOLD,
+    AI_WINDOW_SECONDS,
+    FILE_OP_MAX_REQUESTS,
+    FILE_OP_WINDOW_SECONDS,
+    MAX_HISTORY_LENGTH,
+    RATE_LIMIT_ALGORITHM,
+    SESSION_TTL_HOURS,
+    ActionState,
+    SessionBackend,
+    UserSession,
+    _ai_limit_message,
+    _ai_warning_message,
+    _cooldown_message,
+    _file_op_limit_message,
+    _json_load,
+)
+
+try:
+    import redis
+except ImportError:  # optional: only needed for SESSION_BACKEND=redis
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "tgbot"
+
+# Both scripts use the server clock, so workers on different hosts agree on
+# time, and implement GCRA like rate_limit.GCRA (state: theoretical arrival
+# time). Floats are returned as strings because Redis truncates Lua numbers.
+_NOW = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+"""
+
+_USED = """
+local function used(tat, now, interval, limit)
+  local backlog = tat - now
+  if backlog <= 0 then return 0 end
+  return math.min(limit, math.ceil(backlog / interval - 1e-9))
+end
+"""
+
+# KEYS[1] rate hash; ARGV: limit, window, warning threshold, cooldown, ttl.
+# Returns {status, used, seconds}: status 0 = on cooldown (seconds left),
+# 1 = allowed and counted, 2 = limit hit and cooldown started, 3 = allowed
+# and counted with a warning.
+ACQUIRE_AI_SCRIPT = _NOW + _USED + """
+local limit = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2]) / limit
+local fields = redis.call('HMGET', KEYS[1], 'ai_tat', 'ai_warning_sent', 'ai_cooldown_until')
+local tat = tonumber(fields[1]) or 0
+local cooldown_until = tonumber(fields[3]) or 0
+if cooldown_until > now then
+  return {0, 0, tostring(cooldown_until - now)}
+end
+local n = used(tat, now, interval, limit)
+local status = 1
+if n >= limit then
+  redis.call('HSET', KEYS[1], 'ai_cooldown_until', tostring(now + tonumber(ARGV[4])), 'ai_warning_sent', '0')
+  status = 2
+else
+  if n >= tonumber(ARGV[3]) and fields[2] ~= '1' then status = 3 end
+  redis.call('HSET', KEYS[1], 'ai_tat', tostring(math.max(tat, now) + interval), 'ai_warning_sent', '0')
+end
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return {status, n, '0'}
+"""
+
+# KEYS[1] rate hash; ARGV: limit, window, ttl. Returns {allowed, retry_after}.
+ACQUIRE_FILE_OP_SCRIPT = _NOW + _USED + """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local interval = window / limit
+local tat = tonumber(redis.call('HGET', KEYS[1], 'file_op_tat')) or 0
+if used(tat, now, interval, limit) >= limit then
+  return {0, tostring(math.max(0, tat - now - (window - interval)))}
+end
+redis.call('HSET', KEYS[1], 'file_op_tat', tostring(math.max(tat, now) + interval))
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return {1, '0'}
+"""
+
+# KEYS[1] rate hash; ARGV: limit, window. Gives back one counted file op.
+REFUND_FILE_OP_SCRIPT = _NOW + """
+local tat = tonumber(redis.call('HGET', KEYS[1], 'file_op_tat'))
+if tat then
+  local interval = tonumber(ARGV[2]) / tonumber(ARGV[1])
+  redis.call('HSET', KEYS[1], 'file_op_tat', tostring(math.max(now, tat - interval)))
+end
+"""
+
+# KEYS[1] session hash, KEYS[2] message list; ARGV: max messages, ttl,
+# history start seq, then one JSON-encoded "role", "content" pair per
+# message. Sequence numbers come from HINCRBY so workers appending at the
+# same time never share one, and the history start only moves forward.
+APPEND_MESSAGES_SCRIPT = """
+for i = 4, #ARGV do
+  local seq = redis.call('HINCRBY', KEYS[1], 'next_seq', 1) - 1
+  redis.call('RPUSH', KEYS[2], '[' .. seq .. ', ' .. ARGV[i] .. ']')
+end
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[1]), -1)
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+local start = tonumber(redis.call('HGET', KEYS[1], 'history_start_seq')) or 0
+if tonumber(ARGV[3]) > start then
+  redis.call('HSET', KEYS[1], 'history_start_seq', ARGV[3])
+end
+"""
+
+# Session fields saved as-is when changed; next_seq and history_start_seq
+# are only ever moved by APPEND_MESSAGES_SCRIPT.
+_PLAIN_FIELDS = ("action_state", "action_params", "summary")
+
+
+class RedisSessionBackend(SessionBackend):
+    """Sessions and rate limits in Redis, shared by every bot worker.
+
+    Each user has a session hash, a capped list of recent messages and a
+    rate-limit hash, all expiring after ``SESSION_TTL_HOURS`` of inactivity.
+    Rate limits are checked and counted by Lua scripts so concurrent workers
+    cannot both take the last slot. Saves write only the fields a worker
+    changed, so one worker's update does not revert another's. Any client speaking the Redis protocol
+    with scripting works, e.g. ``fakeredis.FakeRedis()`` in place of a server.
+    """
+
+    shared = True
+
+    def __init__(self, url: Optional[str] = None, client: Any = None, prefix: str = KEY_PREFIX):
+        # The Lua scripts implement GCRA only; refuse rather than silently
+        # apply different limits than the SQLite backend would.
+        if RATE_LIMIT_ALGORITHM != "gcra":
+            raise ValueError(
+                f"SESSION_BACKEND=redis supports only RATE_LIMIT_ALGORITHM='gcra', not {RATE_LIMIT_ALGORITHM!r}"
+            )
+        if client is None:
+            if redis is None:
+                raise RuntimeError("SESSION_BACKEND=redis requires the 'redis' package")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self._client = client
+        self._prefix = prefix
+        self._ttl = SESSION_TTL_HOURS * 3600
+        self._acquire_ai = client.register_script(ACQUIRE_AI_SCRIPT)
+        self._acquire_file_op = client.register_script(ACQUIRE_FILE_OP_SCRIPT)
+        self._refund_file_op = client.register_script(REFUND_FILE_OP_SCRIPT)
+        self._append_messages = client.register_script(APPEND_MESSAGES_SCRIPT)
+        self._ai_limiter = GCRA(AI_MAX_REQUESTS, AI_WINDOW_SECONDS)
+        self._file_op_limiter = GCRA(FILE_OP_MAX_REQUESTS, FILE_OP_WINDOW_SECONDS)
+
+    def _key(self, kind: str, user_id: int) -> str:
+        return f"{self._prefix}:{kind}:{user_id}"
+
+    @staticmethod
+    def _text(value) -> str:
+        return value.decode() if isinstance(value, bytes) else value
+
+    def load(self, user_id: int) -> Optional[UserSession]:
+        pipe = self._client.pipeline(transaction=False)
+        pipe.hgetall(self._key("session", user_id))
+        pipe.lrange(self._key("messages", user_id), -MAX_HISTORY_LENGTH, -1)
+        fields, messages = pipe.execute()
+        if not fields:
+            return None
+        fields = {self._text(k): self._text(v) for k, v in fields.items()}
+        start_seq = int(fields.get("history_start_seq", 0))
+        history = []
+        for raw in messages:
+            message = _json_load(self._text(raw), None)
+            if isinstance(message, list) and len(message) == 3 and message[0] >= start_seq:
+                history.append({'role': message[1], 'parts': [message[2]]})
+        return UserSession(
+            user_id=user_id,
+            action_state=ActionState(fields.get("action_state", ActionState.NONE.value)),
+            action_params=_json_load(fields.get("action_params", "{}"), {}),
+            history=history,
+            summary=fields.get("summary", ""),
+            created_at=float(fields.get("created_at", 0)),
+            history_start_seq=start_seq,
+            next_seq=int(fields.get("next_seq", 0)),
+        )
+
+    def save(self, batch: list[tuple[UserSession, list[tuple]]]):
+        pipe = self._client.pipeline(transaction=True)
+        for session, pending in batch:
+            session_key = self._key("session", session.user_id)
+            values = {
+                "action_state": session.action_state.value,
+                "action_params": json.dumps(session.action_params),
+                "summary": session.summary,
+            }
+            mapping = {name: values[name] for name in _PLAIN_FIELDS if name in session.changed_fields}
+            mapping["updated_at"] = session.updated_at
+            pipe.hset(session_key, mapping=mapping)
+            pipe.hsetnx(session_key, "created_at", session.created_at)
+            pipe.expire(session_key, self._ttl)
+            if pending:
+                self._append_messages(
+                    keys=[session_key, self._key("messages", session.user_id)],
+                    args=[
+                        MAX_HISTORY_LENGTH,
+                        self._ttl,
+                        session.history_start_seq,
+                        *(json.dumps([role, content])[1:-1] for _, role, content, _ in pending),
+                    ],
+                    client=pipe,
+                )
+        pipe.execute()
+
+    def delete_expired(self, cutoff: float) -> list[int]:
+        # Keys carry a TTL, so Redis expires idle sessions itself.
+        return []
+
+    def close(self):
+        self._client.close()
+
+    def acquire_ai_request(self, session: UserSession) -> tuple[bool, str]:
+        status, used, seconds = self._acquire_ai(
+            keys=[self._key("rate", session.user_id)],
+            args=[AI_MAX_REQUESTS, AI_WINDOW_SECONDS, AI_WARNING_THRESHOLD, AI_COOLDOWN_HOURS * 3600, self._ttl],
+        )
+        status = int(status)
+        if status == 0:
+            return False, _cooldown_message(float(seconds))
+        if status == 2:
+            return False, _ai_limit_message()
+        if status == 3:
+            return True, _ai_warning_message(AI_MAX_REQUESTS - int(used))
+        return True, ""
+
+    def acquire_file_op(self, session: UserSession) -> tuple[bool, str]:
+        allowed, retry_after = self._acquire_file_op(
+            keys=[self._key("rate", session.user_id)],
+            args=[FILE_OP_MAX_REQUESTS, FILE_OP_WINDOW_SECONDS, self._ttl],
+        )
+        if int(allowed):
+            return True, ""
+        return False, _file_op_limit_message(float(retry_after))
+
+    def refund_file_op(self, session: UserSession):
+        self._refund_file_op(
+            keys=[self._key("rate", session.user_id)], args=[FILE_OP_MAX_REQUESTS, FILE_OP_WINDOW_SECONDS]
+        )
+
+    def check_file_op(self, session: UserSession) -> tuple[bool, str]:
+        tat = self._client.hget(self._key("rate", session.user_id), "file_op_tat")
+        state = (float(tat or 0),)
+        now = _server_time(self._client)
+        if self._file_op_limiter.used(state, now) >= FILE_OP_MAX_REQUESTS:
+            return False, _file_op_limit_message(self._file_op_limiter.retry_after(state, now))
+        return True, ""
+
+    def get_ai_status(self, session: UserSession) -> tuple[int, int, bool, float]:
+        tat, warning_sent, cooldown_until = self._client.hmget(
+            self._key("rate", session.user_id), "ai_tat", "ai_warning_sent", "ai_cooldown_until"
+        )
+        now = _server_time(self._client)
+        cooldown = float(cooldown_until or 0) - now
+        if cooldown > 0:
+            return 0, AI_MAX_REQUESTS, False, cooldown
+        remaining = self._ai_limiter.remaining((float(tat or 0),), now)
+        return remaining, AI_MAX_REQUESTS, self._text(warning_sent) == "1", 0
+
+
+def _server_time(client) -> float:
+    seconds, micros = client.time()
+    return seconds + micros / 1_000_000
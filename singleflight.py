@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    __slots__ = ("task", "users")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.users = 0
+
+
+class SingleFlight:
+    """Keyed de-duplication of concurrent async work.
+
+    While a call for ``key`` is in flight, further callers with the same key
+    wait for that call's result instead of starting their own. The work runs
+    in its own task, so a caller being cancelled does not cancel it for the
+    others.
+    """
+
+    def __init__(self):
+        self._flights: dict[Hashable, _Flight] = {}
+
+    def _join(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> _Flight:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+
+            def _forget(_task: asyncio.Future, key: Hashable = key, flight: _Flight = flight) -> None:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+            flight.task.add_done_callback(_forget)
+        else:
+            logger.debug("Joined in-flight call for %r", key)
+        flight.users += 1
+        return flight
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        async with self.shared(key, fn) as result:
+            return result
+
+    @asynccontextmanager
+    async def shared(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]],
+        release: Optional[Callable[[Any], None]] = None,
+    ) -> AsyncIterator[Any]:
+        """Like ``do``, but keeps the result alive until every caller has left the block.
+
+        ``release`` is called once with the result after the last caller
+        sharing this flight exits, e.g. to delete a shared temporary file.
+        """
+        flight = self._join(key, fn)
+        try:
+            yield await asyncio.shield(flight.task)
+        finally:
+            flight.users -= 1
+            if release is not None and flight.users == 0:
+                if flight.task.done():
+                    _release_result(flight, release)
+                else:
+                    # Every caller gave up early; release once the work finishes.
+                    flight.task.add_done_callback(lambda _task: _release_result(flight, release))
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+
+def _release_result(flight: _Flight, release: Callable[[Any], None]) -> None:
+    task = flight.task
+    if flight.users or task.cancelled() or task.exception() is not None:
+        return
+    try:
+        release(task.result())
+    except Exception as exc:
+        logger.warning("Single-flight release failed: %s", exc)
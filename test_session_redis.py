@@ -0,0 +1,68 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from session_manager import (  # noqa: E402
+    AI_MAX_REQUESTS,
+    AI_WARNING_THRESHOLD,
+    FILE_OP_MAX_REQUESTS,
+    UserSession,
+)
+from session_redis import RedisSessionBackend  # noqa: E402
+
+
+@pytest.fixture
+def backend():
+    return RedisSessionBackend(client=fakeredis.FakeRedis(decode_responses=True))
+
+
+def test_ai_limit_warns_then_cools_down(backend):
+    session = UserSession(user_id=1)
+    results = [backend.acquire_ai_request(session) for _ in range(AI_MAX_REQUESTS)]
+
+    assert all(allowed for allowed, _ in results)
+    # Like the SQLite backend: once AI_WARNING_THRESHOLD requests are used,
+    # each further allowed request warns with the count left.
+    warnings = {used: message for used, (_, message) in enumerate(results) if message}
+    assert sorted(warnings) == list(range(AI_WARNING_THRESHOLD, AI_MAX_REQUESTS))
+    for used, message in warnings.items():
+        assert f"{AI_MAX_REQUESTS - used} requests remaining" in message
+
+    allowed, message = backend.acquire_ai_request(session)
+    assert not allowed
+    assert "Cooldown:" in message
+    allowed, message = backend.acquire_ai_request(session)
+    assert not allowed
+    assert "Cooldown active" in message
+    remaining, _, _, cooldown = backend.get_ai_status(session)
+    assert remaining == 0
+    assert cooldown > 0
+
+
+def test_file_op_limit(backend):
+    session = UserSession(user_id=2)
+    for _ in range(FILE_OP_MAX_REQUESTS):
+        assert backend.acquire_file_op(session) == (True, "")
+
+    allowed, message = backend.acquire_file_op(session)
+    assert not allowed
+    assert "File operation rate limit exceeded" in message
+    assert not backend.check_file_op(session)[0]
+
+
+def test_refund_frees_a_file_op(backend):
+    session = UserSession(user_id=3)
+    for _ in range(FILE_OP_MAX_REQUESTS):
+        backend.acquire_file_op(session)
+    assert not backend.check_file_op(session)[0]
+
+    backend.refund_file_op(session)
+    assert backend.check_file_op(session) == (True, "")
+    assert backend.acquire_file_op(session) == (True, "")
+    assert not backend.acquire_file_op(session)[0]
+
+
+def test_rejects_other_algorithms(monkeypatch):
+    monkeypatch.setattr("session_redis.RATE_LIMIT_ALGORITHM", "token_bucket")
+    with pytest.raises(ValueError):
+        RedisSessionBackend(client=fakeredis.FakeRedis(decode_responses=True))